@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+
+# Скорость алгоритмов хеширования из hashing.ALGORITHMS на этой машине: чистое хеширование
+# буфера в памяти, хеширование файла через HashReader (файл уже в кэше ОС) и древовидный
+# режим с разным числом потоков.
+#
+#   python benchmarks/bench_hash.py --size 512M --output hash.json
+#   python benchmarks/bench_hash.py --size 512M --compare hash.json
+#
+# По этим цифрам выбирается --algorithm для get_md5_hashes.py: на машинах с быстрым BLAKE2
+# (64-битные x86 и ARM) он обычно обгоняет MD5, а древовидный режим масштабируется по ядрам.
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import hashing
+from bench_integrity import compare, parse_size, write_random_file
+
+BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def measure_memory(algorithm, data, repeat=3):
+    best = None
+    for _ in range(repeat):
+        digest = hashing.new_hash(algorithm)
+        started = time.perf_counter()
+        digest.update(data)
+        digest.digest()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {"seconds": best, "mb_per_s": len(data) / best / 1024 ** 2}
+
+
+def measure_file(path, algorithm, jobs=1, repeat=3):
+    size = path.stat().st_size
+    block_size = BLOCK_SIZE if hashing.is_tree(algorithm) else None
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        hashing.hash_file(path, algorithm, block_size, jobs=jobs)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {"seconds": best, "mb_per_s": size / best / 1024 ** 2}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hash algorithm throughput on this machine.")
+    parser.add_argument("--size", type=parse_size, default=parse_size("256M"), help="size of the hashed file")
+    parser.add_argument("--memory-size", type=parse_size, default=parse_size("64M"), help="size of the in-memory buffer")
+    parser.add_argument("--jobs", default=None, help="comma-separated thread counts for tree mode (default: 1,2,4..cpus)")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    if args.jobs:
+        jobs_list = [int(jobs) for jobs in args.jobs.split(",")]
+    else:
+        jobs_list = [1]
+        while jobs_list[-1] * 2 <= cpus:
+            jobs_list.append(jobs_list[-1] * 2)
+    results = []
+
+    def record(name, **values):
+        results.append({"name": name, **values})
+        print(f"{name:48} " + ", ".join(f"{key}={value:.3f}" for key, value in values.items()))
+
+    data = os.urandom(args.memory_size)
+    for algorithm in hashing.ALGORITHMS:
+        if not hashing.is_tree(algorithm):
+            record(f"memory {algorithm}", **measure_memory(algorithm, data))
+    del data
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = Path(temp_dir) / "data.arc"
+        write_random_file(path, args.size, os.urandom(4 * 1024 * 1024))
+        hashing.hash_file(path)  # прогрев кэша ОС
+        for algorithm in hashing.ALGORITHMS:
+            for jobs in (jobs_list if hashing.is_tree(algorithm) else [1]):
+                record(f"file {algorithm} jobs={jobs}", **measure_file(path, algorithm, jobs))
+
+    if args.output:
+        report = {"machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": cpus},
+                  "size": args.size, "results": results}
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nResults saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+from pathlib import Path
+
+# Замеры скорости проверки целостности на синтетической установке, похожей на настоящую:
+# несколько больших архивов data*.arc и тысячи мелких файлов вместе с манифестом.
+#
+#   python benchmarks/bench_integrity.py --tree D:\bench --archive-size 2G --output before.json
+#   python benchmarks/bench_integrity.py --tree D:\bench --output after.json --compare before.json
+#
+# Каждый замер проверки идёт в отдельном процессе, чтобы пиковое потребление памяти
+# относилось именно к нему. Холодный кэш получается сбросом страниц файлов через
+# posix_fadvise, на Windows такой возможности нет, и холодные замеры там пропускаются.
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import get_md5_hashes
+import hashing
+import integrity
+import manifest
+
+MANIFEST_NAME = "file_hashes.bin"
+
+
+def parse_size(text):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper().rstrip("B").rstrip("I")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def peak_rss():
+    # Пиковый размер рабочего набора текущего процесса в байтах
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb)
+        return counters.PeakWorkingSetSize
+
+    # ru_maxrss на Linux переживает fork+exec, и дочерний процесс видел бы пик родителя.
+    # VmHWM при exec сбрасывается, поэтому там берём его
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def drop_file_cache(root):
+    # Выкидывает страницы файлов установки из кэша ОС. Возвращает False, если ОС этого не умеет.
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for entry in get_md5_hashes.walk_files(root):
+        fd = os.open(entry.path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+def write_random_file(path, size, seed_block):
+    # Содержимое различается между файлами и блоками, чтобы ничего не сжималось и не дедуплицировалось
+    with open(path, "wb") as f:
+        written = 0
+        counter = 0
+        while written < size:
+            chunk = counter.to_bytes(8, "little") + path.name.encode() + seed_block
+            chunk = chunk[:min(len(seed_block), size - written)]
+            f.write(chunk)
+            written += len(chunk)
+            counter += 1
+
+
+def generate_tree(root, archives, archive_size, small_files, small_size):
+    root.mkdir(parents=True, exist_ok=True)
+    seed_block = os.urandom(4 * 1024 * 1024)
+    for idx in range(archives):
+        write_random_file(root / f"data0{2300 + idx}.arc", archive_size, seed_block)
+    small_dir = root / "UserData" / "small"
+    small_dir.mkdir(parents=True, exist_ok=True)
+    for idx in range(small_files):
+        (small_dir / f"file{idx:05d}.bin").write_bytes(os.urandom(small_size))
+
+
+def ensure_tree(args):
+    root = Path(args.tree) if args.tree else Path(tempfile.gettempdir()) / "sakuuta_bench"
+    manifest_path = root.parent / (root.name + "." + MANIFEST_NAME)
+    params_path = root.parent / (root.name + ".json")
+    params = {"archives": args.archives, "archive_size": args.archive_size,
+              "small_files": args.small_files, "small_size": args.small_size}
+    if not (params_path.exists() and json.loads(params_path.read_text()) == params and manifest_path.exists()):
+        print(f"Generating synthetic install in {root} ...")
+        generate_tree(root, **params)
+        records = get_md5_hashes.generate_file_hashes(root, get_md5_hashes.BLOCK_SIZE)
+        manifest.write_manifest(manifest_path, records, "md5", get_md5_hashes.BLOCK_SIZE)
+        params_path.write_text(json.dumps(params))
+    return root, manifest_path
+
+
+def run_check(root, manifest_path, jobs, buffer_size, cold):
+    # Один замер проверки. Выполняется в отдельном процессе (см. --run-check).
+    if cold and not drop_file_cache(root):
+        return None
+    file_list = integrity.load_file_list(manifest_path, root)
+    reader = hashing.HashReader(buffer_size=buffer_size)
+    started = time.perf_counter()
+    results = integrity.check_files(file_list, jobs=jobs, reader=reader)
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(entry[2] for entry in file_list)
+    failed = sum(1 for _, status, _ in results if status != integrity.OK)
+    return {"seconds": elapsed, "files_per_s": len(file_list) / elapsed, "mb_per_s": total_bytes / elapsed / 1024 ** 2,
+            "failed": failed, "peak_rss": peak_rss()}
+
+
+def measure_check(root, manifest_path, jobs, buffer_size, cold):
+    command = [sys.executable, __file__, "--run-check", str(root), str(manifest_path),
+               str(jobs), str(buffer_size), "cold" if cold else "warm"]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_manifest_load(manifest_path, root, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        integrity.load_file_list(manifest_path, root)
+    return {"seconds": (time.perf_counter() - started) / repeat}
+
+
+def measure_hash(root, buffer_size, use_mmap):
+    # Скорость хеширования одного самого большого файла (обычно уже в кэше)
+    biggest = max((Path(entry.path) for entry in get_md5_hashes.walk_files(root)), key=lambda path: path.stat().st_size)
+    reader = hashing.HashReader(buffer_size=buffer_size, use_mmap=use_mmap)
+    started = time.perf_counter()
+    reader.hash_file(biggest)
+    elapsed = time.perf_counter() - started
+    return {"seconds": elapsed, "mb_per_s": biggest.stat().st_size / elapsed / 1024 ** 2}
+
+
+def measure_generate(root, manifest_path):
+    started = time.perf_counter()
+    get_md5_hashes.generate_file_hashes(root, get_md5_hashes.BLOCK_SIZE)
+    full = time.perf_counter() - started
+    with manifest.Manifest.load(manifest_path) as previous:
+        started = time.perf_counter()
+        get_md5_hashes.generate_file_hashes(root, get_md5_hashes.BLOCK_SIZE, previous)
+        incremental = time.perf_counter() - started
+    return {"full_seconds": full, "incremental_seconds": incremental}
+
+
+def compare(results, baseline_path):
+    baseline = {item["name"]: item for item in json.loads(Path(baseline_path).read_text())["results"]}
+    print(f"\n{'benchmark':48} {'before':>10} {'after':>10} {'change':>8}")
+    for item in results:
+        before = baseline.get(item["name"])
+        if not before or not before.get("seconds") or not item.get("seconds"):
+            continue
+        change = (item["seconds"] - before["seconds"]) / before["seconds"] * 100
+        print(f"{item['name']:48} {before['seconds']:10.3f} {item['seconds']:10.3f} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Integrity check benchmarks on a synthetic install.")
+    parser.add_argument("--tree", default=None, help="where to create (or reuse) the synthetic install")
+    parser.add_argument("--archives", type=int, default=4)
+    parser.add_argument("--archive-size", type=parse_size, default=parse_size("256M"))
+    parser.add_argument("--small-files", type=int, default=3000)
+    parser.add_argument("--small-size", type=parse_size, default=parse_size("16K"))
+    parser.add_argument("--jobs", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--buffer-sizes", default="64K,1M,4M", help="comma-separated read buffer sizes")
+    parser.add_argument("--no-cold", action="store_true", help="skip cold-cache runs")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--run-check", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_check:
+        root, manifest_path, jobs, buffer_size, mode = args.run_check
+        print(json.dumps(run_check(Path(root), Path(manifest_path), int(jobs), int(buffer_size), mode == "cold")))
+        return
+
+    root, manifest_path = ensure_tree(args)
+    jobs_list = [int(jobs) for jobs in args.jobs.split(",")]
+    buffer_sizes = [parse_size(size) for size in args.buffer_sizes.split(",")]
+    results = []
+
+    def record(name, **values):
+        results.append({"name": name, **values})
+        print(f"{name:48} " + ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}"
+                                         for key, value in values.items()))
+
+    record("manifest_load", **measure_manifest_load(manifest_path, root))
+    for buffer_size in buffer_sizes:
+        for use_mmap in (False, True):
+            record(f"hash_file buffer={buffer_size} mmap={use_mmap}", **measure_hash(root, buffer_size, use_mmap))
+    for cold in ((False,) if args.no_cold else (True, False)):
+        for jobs in jobs_list:
+            for buffer_size in buffer_sizes:
+                name = f"check_files {'cold' if cold else 'warm'} jobs={jobs} buffer={buffer_size}"
+                if not cold:
+                    measure_check(root, manifest_path, jobs, buffer_size, False)  # прогрев кэша
+                result = measure_check(root, manifest_path, jobs, buffer_size, cold)
+                if result is None:
+                    print(f"{name:48} skipped: cannot drop the OS file cache here")
+                    continue
+                record(name, **result)
+    record("generate_file_hashes", **measure_generate(root, manifest_path))
+
+    report = {
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "cpus": os.cpu_count(), "rotational": integrity.is_rotational(root)},
+        "tree": {"archives": args.archives, "archive_size": args.archive_size,
+                 "small_files": args.small_files, "small_size": args.small_size},
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"\nResults saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+# Время запуска утилиты до появления окна: собранного compile.bat exe или, если его нет, main.py.
+#
+#   python benchmarks/bench_startup.py --output startup.json
+#   python benchmarks/bench_startup.py --exe main.exe --budget 2.5 --compare startup.json
+#
+# Утилита запускается с переменной окружения из main.EXIT_AFTER_START_ENV и закрывается сама,
+# как только окно показано, так что замеряется время от запуска процесса до его завершения.
+# С --budget скрипт завершается с кодом 1, если медиана превысила бюджет.
+# Для main.py дополнительно выводятся самые долгие импорты (python -X importtime).
+
+ROOT = Path(__file__).resolve().parent.parent
+
+from bench_integrity import compare
+
+EXIT_AFTER_START_ENV = "SAKUUTA_EXIT_AFTER_START"
+DEFAULT_EXE = ROOT / "main.exe"
+
+
+def launch_command(exe):
+    if exe:
+        return [str(exe)]
+    if DEFAULT_EXE.exists():
+        return [str(DEFAULT_EXE)]
+    return [sys.executable, str(ROOT / "main.py")]
+
+
+def measure_startup(command, cwd, runs):
+    env = dict(os.environ, **{EXIT_AFTER_START_ENV: "1"})
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=cwd, env=env, check=True, timeout=120)
+        times.append(time.perf_counter() - started)
+    return {"seconds": statistics.median(times), "min_seconds": min(times), "max_seconds": max(times), "runs": runs}
+
+
+def measure_imports(cwd, top=15):
+    # Самые долгие импорты при загрузке main.py: [(модуль, мкс с вложенными импортами), ...]
+    command = [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {str(ROOT)!r}); import main"]
+    stderr = subprocess.run(command, cwd=cwd, check=True, capture_output=True, text=True).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            imports.append((name.strip(), int(cumulative)))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time from launch to the first window.")
+    parser.add_argument("--exe", default=None, help="built executable (default: main.exe if present, else main.py)")
+    parser.add_argument("--cwd", default=None, help="directory to run in, as if it were the game folder (default: temporary)")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=None, help="fail if the median startup exceeds this many seconds")
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    command = launch_command(args.exe)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cwd = args.cwd or temp_dir
+        # Первый запуск не считаем: он прогревает кэш ОС (и распаковку one-file exe)
+        measure_startup(command, cwd, 1)
+        result = measure_startup(command, cwd, args.runs)
+        name = f"startup {Path(command[-1]).name}"
+        print(f"{name:48} median={result['seconds']:.3f}s min={result['min_seconds']:.3f}s max={result['max_seconds']:.3f}s")
+        results = [{"name": name, **result}]
+
+        if command[-1].endswith(".py"):
+            print("\nSlowest imports (cumulative):")
+            for module, micros in measure_imports(cwd):
+                print(f"  {module:40} {micros / 1000:8.1f} ms")
+
+    if args.output:
+        report = {"machine": {"platform": platform.platform(), "python": platform.python_version()},
+                  "command": command, "results": results}
+        Path(args.output).write_text(json.dumps(report, indent=2))
+        print(f"\nResults saved to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+    if args.budget is not None and result["seconds"] > args.budget:
+        print(f"\nStartup {result['seconds']:.3f}s is over the {args.budget:.3f}s budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
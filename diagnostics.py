@@ -0,0 +1,276 @@
+import os
+import sys
+import abc
+import locale
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import hashing
+import integrity
+import repair
+
+# Быстрые проверки системы (шрифт, локаль и ipl._bp, путь к игре) и планировщик, который
+# запускает их одновременно с долгой проверкой целостности. Всё, что зависит от Windows
+# (реестр, ctypes.windll, папка Fonts), спрятано за SystemProbe, поэтому проверки и планировщик
+# работают и с FakeProbe на любой ОС (см. main: python diagnostics.py --fake).
+
+FONT_NAME = "YasuSakuuta.ttf"
+
+# Первичные языки, для которых подходит русский ipl._bp
+LOCALE_RUSSIAN = [
+    0x19,  # Русский
+    0x22,  # Украинский
+    0x02,  # Болгарский
+    0x1a,  # Сербский (кириллица)
+    0x2f,  # Македонский
+    0x50,  # Монгольский (кириллица)
+    0x23,  # Белорусский
+    0x43,  # Узбекский (кириллица)
+    0x40  # Киргизский (кириллица)
+]
+LOCALE_JAPANESE = 0x11
+
+# Хеши вариантов ipl._bp (алгоритм, хеш) и файлы в папке repair, которыми его заменить
+IPL_RU = ("md5", bytes.fromhex("3190ae2bf6ff7ec09869cebb9bd102b8"), "ipl_ru._bp")
+IPL_JP = ("md5", bytes.fromhex("31888256646e301b74f8d7ce744eb0b8"), "ipl_jp._bp")
+IPL_UNIVERSAL = "ipl._bp"
+
+
+class SystemProbe(abc.ABC):
+    # Сведения о системе, нужные проверкам. Каждый ответ запрашивается один раз и кэшируется:
+    # за время работы утилиты система меняется только через неё саму, и после таких изменений
+    # вызывается forget(). Методы можно вызывать из любых потоков.
+
+    def __init__(self):
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, name, func):
+        # Под блокировкой, чтобы одновременные проверки не спрашивали систему дважды
+        with self._lock:
+            if name not in self._cache:
+                self._cache[name] = func()
+            return self._cache[name]
+
+    def forget(self, name=None):
+        with self._lock:
+            if name is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(name, None)
+
+    def font_files(self):
+        # Имена файлов установленных шрифтов в нижнем регистре
+        return self._cached("font_files", self._font_files)
+
+    def locale_info(self):
+        # (LANGID, первичный язык, название локали, кодовая страница ANSI, имя кодировки)
+        return self._cached("locale_info", self._locale_info)
+
+    def install_font(self, source_path, expected_hash=None, algorithm=hashing.DEFAULT_ALGORITHM, block_size=None):
+        # expected_hash - хеш исправного файла шрифта (как в манифесте, см. repair.copy_verified):
+        # повреждённая копия не устанавливается
+        self._install_font(Path(source_path), expected_hash, algorithm, block_size)
+        self.forget("font_files")
+
+    @abc.abstractmethod
+    def _font_files(self):
+        pass
+
+    @abc.abstractmethod
+    def _locale_info(self):
+        pass
+
+    @abc.abstractmethod
+    def _install_font(self, source_path, expected_hash, algorithm, block_size):
+        pass
+
+
+class WindowsProbe(SystemProbe):
+    def fonts_dir(self):
+        return Path(os.environ['WINDIR']) / 'Fonts'
+
+    def _font_files(self):
+        return frozenset(font.name.lower() for font in self.fonts_dir().iterdir())
+
+    def _locale_info(self):
+        import ctypes
+        lang_id = ctypes.windll.kernel32.GetSystemDefaultLangID()
+        primary_lang_id = lang_id & 0x3ff
+        locale_name = locale.windows_locale.get(lang_id, "Неизвестная")
+        codepage = ctypes.windll.kernel32.GetACP()
+        return lang_id, primary_lang_id, locale_name, codepage, 'cp' + str(codepage)
+
+    def _install_font(self, source_path, expected_hash, algorithm, block_size):
+        import ctypes
+        import winreg
+        dest_path = self.fonts_dir() / source_path.name
+        if not repair.copy_verified(source_path, dest_path, expected_hash, algorithm=algorithm, block_size=block_size):
+            raise OSError(f"файл '{source_path}' повреждён")
+        # Регистрация шрифта в реестре
+        key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts", 0, winreg.KEY_SET_VALUE | winreg.KEY_WRITE)
+        winreg.SetValueEx(key, source_path.name, 0, winreg.REG_SZ, source_path.name)
+        winreg.CloseKey(key)
+
+        # Обновляем кэш шрифтов
+        ctypes.windll.gdi32.AddFontResourceW(str(dest_path))
+        ctypes.windll.user32.SendMessageW(0xffff, 0x001D, 0, 0)
+
+
+class FakeProbe(SystemProbe):
+    # Заранее заданные ответы вместо обращений к Windows, для проверки на других ОС
+    def __init__(self, font_files=(), lang_id=0x419, codepage=1251):
+        super().__init__()
+        self.fonts = {name.lower() for name in font_files}
+        self.lang_id = lang_id
+        self.codepage = codepage
+
+    def _font_files(self):
+        return frozenset(self.fonts)
+
+    def _locale_info(self):
+        locale_name = locale.windows_locale.get(self.lang_id, "Неизвестная")
+        return self.lang_id, self.lang_id & 0x3ff, locale_name, self.codepage, 'cp' + str(self.codepage)
+
+    def _install_font(self, source_path, expected_hash, algorithm, block_size):
+        self.fonts.add(source_path.name.lower())
+
+
+class Finding:
+    # Итог одной проверки: ok - проблем нет, text - строка для общего отчёта,
+    # data - то, что понадобится для исправления
+    def __init__(self, name, ok, text, **data):
+        self.name = name
+        self.ok = ok
+        self.text = text
+        self.data = data
+
+
+def check_font(probe, font_name=FONT_NAME):
+    if font_name.lower() in probe.font_files():
+        return Finding("font", True, f"шрифт '{font_name}' установлен", font_name=font_name)
+    return Finding("font", False, f"шрифт '{font_name}' не установлен", font_name=font_name)
+
+
+def check_locale(probe, ipl_path):
+    # Подходит ли ipl._bp к системной локали. replacement - файл из папки repair, которым его
+    # заменить, replacement_hash - его хеш (None - неизвестен) по алгоритму replacement_algorithm;
+    # supported - есть ли для этой локали свой вариант файла.
+    _, primary_lang_id, locale_name, _, _ = probe.locale_info()
+    if primary_lang_id in LOCALE_RUSSIAN:
+        expected = IPL_RU
+    elif primary_lang_id == LOCALE_JAPANESE:
+        expected = IPL_JP
+    else:
+        return Finding("locale", False, f'локаль "{locale_name}" напрямую не поддерживается',
+                       locale_name=locale_name, replacement=IPL_UNIVERSAL, replacement_hash=None,
+                       replacement_algorithm=None, supported=False)
+
+    algorithm, digest, replacement = expected
+    data = dict(locale_name=locale_name, replacement=replacement, replacement_hash=digest,
+                replacement_algorithm=algorithm, supported=True)
+    if integrity.compute_file_hash(ipl_path, algorithm=algorithm) == digest:
+        return Finding("locale", True, f'файл "{Path(ipl_path).name}" подходит к локали "{locale_name}"', **data)
+    return Finding("locale", False, f'файл "{Path(ipl_path).name}" не подходит к локали "{locale_name}"', **data)
+
+
+def invalid_path_parts(path, encoding):
+    # Части пути, которые нельзя записать в кодировке системной локали
+    invalid_components = []
+    for part in Path(path).parts:
+        try:
+            part.encode(encoding)
+        except UnicodeEncodeError:
+            invalid_components.append(part)
+    return invalid_components
+
+
+def check_path(probe, path):
+    _, _, locale_name, _, encoding = probe.locale_info()
+    invalid_components = invalid_path_parts(path, encoding)
+    if not invalid_components:
+        return Finding("path", True, f"путь подходит к локали ({locale_name}, {encoding})",
+                       locale_name=locale_name, encoding=encoding, invalid=[])
+    return Finding("path", False, "в пути есть символы, недопустимые для локали "
+                                  f"({locale_name}, {encoding}): " + ", ".join(invalid_components),
+                   locale_name=locale_name, encoding=encoding, invalid=invalid_components)
+
+
+def system_checks(probe, root):
+    # Задачи для Scheduler: все быстрые проверки папки с игрой root
+    root = Path(root)
+    return {
+        "font": lambda: check_font(probe),
+        "locale": lambda: check_locale(probe, root / "ipl._bp"),
+        "path": lambda: check_path(probe, os.path.abspath(root)),
+    }
+
+
+class Scheduler:
+    # Запускает независимые проверки одновременно, каждую в своём потоке, и собирает их итоги.
+    # tasks: {имя: функция без аргументов}. Ошибка проверки становится её итогом, а не
+    # прерывает остальные.
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        self.futures = {}
+        self.executor = None
+
+    def start(self):
+        self.executor = ThreadPoolExecutor(max_workers=max(len(self.tasks), 1))
+        self.futures = {name: self.executor.submit(task) for name, task in self.tasks.items()}
+        self.executor.shutdown(wait=False)
+        return self
+
+    def done(self):
+        return all(future.done() for future in self.futures.values())
+
+    def results(self, timeout=None):
+        # {имя: итог или исключение}, ждёт незавершённые проверки
+        results = {}
+        for name, future in self.futures.items():
+            try:
+                results[name] = future.result(timeout)
+            except Exception as e:
+                results[name] = e
+        return results
+
+
+def main(argv=None):
+    # Быстрые проверки без интерфейса. Не на Windows (или с --fake) ответы системы берутся
+    # из параметров, так что проверки и планировщик можно прогнать где угодно.
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="diagnostics",
+                                     description="Font, locale and path checks for a Sakura no Uta install. "
+                                                 "Exit codes: 0 - no problems, 1 - problems found, 2 - a check failed.")
+    parser.add_argument("--root", default=".", help="game install directory (default: current directory)")
+    parser.add_argument("--fake", action="store_true",
+                        help="take system answers from the options below instead of Windows (always on other OSes)")
+    parser.add_argument("--lang-id", type=lambda text: int(text, 0), default=0x419,
+                        help="system default LANGID for --fake (default: 0x419, Russian)")
+    parser.add_argument("--codepage", type=int, default=1251, help="ANSI code page for --fake (default: 1251)")
+    parser.add_argument("--font", action="append", default=[], help="installed font file name for --fake, repeatable")
+    args = parser.parse_args(argv)
+
+    if args.fake or sys.platform != "win32":
+        probe = FakeProbe(args.font, args.lang_id, args.codepage)
+    else:
+        probe = WindowsProbe()
+    results = Scheduler(system_checks(probe, args.root)).start().results()
+
+    exit_code = 0
+    for name, finding in results.items():
+        if isinstance(finding, Exception):
+            print(f"{name}: error: {finding}")
+            exit_code = 2
+        else:
+            print(f"{name}: {'ok' if finding.ok else 'problem'}: {finding.text}")
+            if not finding.ok:
+                exit_code = max(exit_code, 1)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
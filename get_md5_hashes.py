@@ -1,35 +1,167 @@
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import hashlib
-import pickle
 
-def get_all_files(directory):
-    return [f for f in directory.rglob('*') if f.is_file() and f.name != Path(__file__).name]
+import hashing
+import integrity
+import manifest
 
-def compute_md5(file_path):
-    md5_hash = hashlib.md5()
+# Размер блока для поблочных хешей. Для файлов больше блока в манифест
+# дополнительно пишется хеш каждого блока, чтобы при проверке можно было
+# остановиться на первом повреждённом блоке и указать повреждённые участки.
+BLOCK_SIZE = 8 * 1024 * 1024
+
+# Размер каждого выборочного участка для быстрой проверки (см. hashing.sample_regions)
+SAMPLE_SIZE = 64 * 1024
+
+def walk_files(directory):
+    # Обходит дерево по мере чтения папок, не собирая заранее полный список.
+    # Внутри папки - по алфавиту, чтобы порядок записей в манифесте не менялся от сборки к сборке.
+    with os.scandir(directory) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_files(entry.path)
+        elif entry.is_file() and entry.name != Path(__file__).name:
+            yield entry
+
+def compute_hash(file_path, block_size=None, algorithm=hashing.DEFAULT_ALGORITHM, jobs=1, reader=None):
     try:
-        with file_path.open("rb") as f:
-            print(f"Calculating MD5 for {file_path.name}")
-            for chunk in iter(lambda: f.read(4096), b""):
-                md5_hash.update(chunk)
-        return md5_hash.hexdigest()
+        return hashing.hash_file(file_path, algorithm, block_size, reader, jobs)
     except Exception as e:
-        print(f"Error calculating MD5 for {file_path}: {e}")
+        print(f"Error calculating {algorithm} for {file_path}: {e}")
+        return (None, None) if block_size else None
+
+def _reusable(previous, rel_path, st, block_size, algorithm):
+    # Запись прошлого манифеста, если файл с тех пор не менялся по размеру и времени изменения
+    # и манифест посчитан тем же алгоритмом
+    if previous is None or previous.algorithm != algorithm:
+        return None
+    idx = previous.find(rel_path)
+    if idx is None:
         return None
+    record = previous.entry(idx)
+    _, _, size, mtime_ns, block_hashes = record
+    chunked = bool(block_size) and size > block_size
+    if size != st.st_size or mtime_ns != st.st_mtime_ns or not mtime_ns:
+        return None
+    if chunked != bool(block_hashes) or (chunked and previous.block_size != block_size):
+        return None
+    return record
+
+def generate_file_hashes(directory, block_size=None, previous=None, jobs=None, algorithm=hashing.DEFAULT_ALGORITHM,
+                         reader=None):
+    # Возвращает записи манифеста (путь, хеш, размер, mtime_ns, [хеши блоков] или None).
+    # Хеши блоков пишутся только с block_size и только для файлов больше блока.
+    # previous - прошлый manifest.Manifest: файлы с теми же размером и mtime не перехешируются.
+    # Новые и изменённые файлы хешируются параллельно в jobs потоков. У древовидных алгоритмов
+    # бюджет jobs делится между файлами и блоками одного большого файла, чтобы последний
+    # архив не хешировался в один поток. reader - HashReader для чтения, по умолчанию общий.
+    directory = Path(directory)
+    if jobs is None:
+        jobs = integrity.pick_jobs(directory)
+    block_jobs = max(1, jobs // 2) if hashing.is_tree(algorithm) else 1
+
+    def hash_record(file_path, rel_path, st):
+        if block_size and st.st_size > block_size:
+            digest, block_hashes = compute_hash(file_path, block_size, algorithm, block_jobs, reader)
+        else:
+            digest, block_hashes = compute_hash(file_path, algorithm=algorithm, reader=reader), None
+        return (rel_path, digest, st.st_size, st.st_mtime_ns, block_hashes) if digest else None
+
+    slots = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs // block_jobs)) as executor:
+        for entry in walk_files(directory):
+            file_path = Path(entry.path)
+            rel_path = file_path.relative_to(directory).as_posix()
+            st = entry.stat()
+            record = _reusable(previous, rel_path, st, block_size, algorithm)
+            slots.append(record or executor.submit(hash_record, file_path, rel_path, st))
 
-def generate_file_hashes(directory):
-    files = get_all_files(directory)
-    file_hash_list = []
-    for file_path in files:
-        md5 = compute_md5(file_path)
-        if md5:
-            rel_path = file_path.relative_to(directory)
-            file_size = file_path.stat().st_size
-            file_hash_list.append((str(rel_path), md5, file_size))
+        file_hash_list = []
+        for slot in slots:
+            record = slot if isinstance(slot, tuple) else slot.result()
+            if record:
+                file_hash_list.append(record)
     return file_hash_list
 
+def generate_samples(directory, records, sample_size=SAMPLE_SIZE, previous=None, jobs=None,
+                     algorithm=hashing.DEFAULT_ALGORITHM):
+    # Хеши выборочных участков для быстрой проверки, по одному на запись манифеста.
+    # У небольших файлов выборка - это весь файл, и её хеш уже посчитан.
+    # Из прошлого манифеста берутся выборки файлов с теми же хешем, размером и mtime.
+    directory = Path(directory)
+    if jobs is None:
+        jobs = integrity.pick_jobs(directory)
+    reuse = previous is not None and previous.sample_size == sample_size and previous.algorithm == algorithm
+
+    def sample(rel_path, digest, size, mtime_ns):
+        regions = hashing.sample_regions(size, sample_size)
+        if regions == [(0, size)] and not hashing.is_tree(algorithm):
+            return digest
+        idx = previous.find(rel_path) if reuse else None
+        if idx is not None and mtime_ns and previous.entry(idx)[1:4] == (digest, size, mtime_ns):
+            return previous.sample(idx)
+        try:
+            return hashing.default_reader.hash_regions(directory / rel_path, regions, algorithm)
+        except OSError as e:
+            print(f"Error sampling {rel_path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(lambda record: sample(*record[:4]), records))
+
+def diff_manifests(previous, records):
+    # Возвращает (добавленные, удалённые, изменённые) относительные пути
+    if previous is None:
+        return [record[0] for record in records], [], []
+    added, changed = [], []
+    seen = set()
+    for rel_path, md5, size, _, _ in records:
+        seen.add(rel_path)
+        idx = previous.find(rel_path)
+        if idx is None:
+            added.append(rel_path)
+        else:
+            _, old_md5, old_size, _, _ = previous.entry(idx)
+            if (old_md5, old_size) != (md5, size):
+                changed.append(rel_path)
+    removed = [rel_path for rel_path, *_ in previous if rel_path not in seen]
+    return added, removed, changed
+
+def print_diff(added, removed, changed):
+    for title, paths in (("Added", added), ("Removed", removed), ("Changed", changed)):
+        print(f"{title}: {len(paths)}")
+        for rel_path in paths:
+            print(f"  {rel_path}")
+
 if __name__ == "__main__":
-    directory = Path("D:\\setup_input\\sakura")
-    hashes = generate_file_hashes(directory)
-    with open("file_hashes.bin", "wb") as f:
-        pickle.dump(hashes, f)
+    parser = argparse.ArgumentParser(description="Build file_hashes.bin for a game directory.")
+    parser.add_argument("directory", nargs="?", default="D:\\setup_input\\sakura")
+    parser.add_argument("--output", default="file_hashes.bin")
+    parser.add_argument("--full", action="store_true", help="re-hash every file, ignore the previous manifest")
+    parser.add_argument("--jobs", type=int, default=None)
+    parser.add_argument("--algorithm", choices=hashing.ALGORITHMS, default=hashing.DEFAULT_ALGORITHM,
+                        help="hash algorithm stored in the manifest (default: md5)")
+    args = parser.parse_args()
+
+    previous = None
+    if not args.full and Path(args.output).exists():
+        try:
+            previous = manifest.Manifest.load(args.output)
+        except Exception as e:
+            print(f"Previous manifest ignored: {e}")
+
+    try:
+        # Вся установка читается один раз, держать её в кэше ОС незачем
+        reader = hashing.HashReader(drop_cache=True)
+        hashes = generate_file_hashes(Path(args.directory), BLOCK_SIZE, previous, args.jobs, args.algorithm, reader)
+        samples = generate_samples(Path(args.directory), hashes, SAMPLE_SIZE, previous, args.jobs, args.algorithm)
+        print_diff(*diff_manifests(previous, hashes))
+    finally:
+        # Отображение прошлого манифеста нужно закрыть до перезаписи файла
+        if previous is not None:
+            previous.close()
+
+    manifest.write_manifest(args.output, hashes, args.algorithm, BLOCK_SIZE, samples, SAMPLE_SIZE)
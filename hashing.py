@@ -0,0 +1,286 @@
+import os
+import mmap
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Общий читатель для хеширования файлов (проверка целостности, генерация манифеста, починка).
+# Читает через readinto в заранее выделенный буфер, так что на каждый кусок не создаётся
+# новый объект bytes, а хешу передаётся memoryview без копирования.
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# Алгоритмы хеширования. "tree-..." - древовидный вариант: файл режется на блоки (листья),
+# хешируемые независимо, а хеш файла - это хеш подряд записанных хешей листьев. Листья можно
+# считать параллельно на нескольких ядрах даже для одного большого архива. Файл не больше
+# одного блока - это единственный лист, и его хеш совпадает с обычным хешем базового алгоритма.
+TREE_PREFIX = "tree-"
+ALGORITHMS = ("md5", "blake2b", "blake2s", "tree-md5", "tree-blake2b", "tree-blake2s")
+DEFAULT_ALGORITHM = "md5"
+
+# Быстрая проверка читает не весь файл, а начало, конец и SAMPLE_COUNT псевдослучайных участков
+SAMPLE_COUNT = 3
+
+_O_FLAGS = os.O_RDONLY | getattr(os, "O_BINARY", 0) | getattr(os, "O_SEQUENTIAL", 0)
+_HAS_FADVISE = hasattr(os, "posix_fadvise")
+
+
+def is_tree(algorithm):
+    return algorithm.startswith(TREE_PREFIX)
+
+
+def new_hash(algorithm=DEFAULT_ALGORITHM):
+    # Объект hashlib базового алгоритма (для древовидного - алгоритма листьев)
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Неизвестный алгоритм хеширования: {algorithm}")
+    return hashlib.new(algorithm[len(TREE_PREFIX):] if is_tree(algorithm) else algorithm)
+
+
+def tree_root(leaves, algorithm):
+    if len(leaves) == 1:
+        return leaves[0]
+    root = new_hash(algorithm)
+    for leaf in leaves:
+        root.update(leaf)
+    return root.digest()
+
+
+class Hasher:
+    # Потоковый хеш файла по любому из ALGORITHMS, когда данные идут не через HashReader
+    # (например, при копировании). Для древовидных алгоритмов данные режутся на листья
+    # по block_size, без него весь поток считается одним листом.
+
+    def __init__(self, algorithm=DEFAULT_ALGORITHM, block_size=None):
+        self.algorithm = algorithm
+        self.block_size = block_size if is_tree(algorithm) else None
+        self.current = new_hash(algorithm)
+        self.filled = 0
+        self.leaves = []
+
+    def update(self, data):
+        if not self.block_size:
+            self.current.update(data)
+            return
+        view = memoryview(data)
+        while len(view):
+            size = min(len(view), self.block_size - self.filled)
+            self.current.update(view[:size])
+            self.filled += size
+            view = view[size:]
+            if self.filled == self.block_size:
+                self.leaves.append(self.current.digest())
+                self.current = new_hash(self.algorithm)
+                self.filled = 0
+
+    def digest(self):
+        if not self.block_size:
+            return self.current.digest()
+        return tree_root(self.leaves + ([self.current.digest()] if self.filled else []), self.algorithm)
+
+
+class Cancelled(Exception):
+    # Чтение прервано через HashReader.cancel
+    pass
+
+
+class HashReader:
+    # buffer_size - размер буфера чтения (для mmap - размер отдаваемых кусков).
+    # use_mmap - читать файл через отображение в память вместо readinto.
+    # sequential - подсказать ОС, что файл читается последовательно (упреждающее чтение).
+    # drop_cache - после чтения попросить ОС выкинуть страницы файла из кэша, чтобы полная
+    # проверка не вытесняла из памяти всё остальное. На Windows такой подсказки нет,
+    # там используется только O_SEQUENTIAL.
+    # on_read(path, size) - вызывается из читающего потока после каждого прочитанного куска.
+    # cancel - threading.Event: когда он установлен, чтение прерывается на следующем куске
+    # исключением Cancelled, даже посреди файла.
+
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE, use_mmap=False, sequential=True, drop_cache=False,
+                 on_read=None, cancel=None):
+        self.buffer_size = buffer_size
+        self.use_mmap = use_mmap
+        self.sequential = sequential
+        self.drop_cache = drop_cache
+        self.on_read = on_read
+        self.cancel = cancel
+        self._local = threading.local()
+
+    def _buffer(self):
+        # Буфер свой у каждого потока, чтобы один читатель можно было делить между потоками пула
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or len(buffer) != self.buffer_size:
+            buffer = memoryview(bytearray(self.buffer_size))
+            self._local.buffer = buffer
+        return buffer
+
+    def chunks(self, path, offset=0, length=None, block_size=None):
+        # Отдаёт содержимое файла (или его участка) кусками memoryview. Кусок действителен
+        # только до получения следующего. С block_size куски не пересекают границы блоков.
+        fd = self._open(path)
+        chunks = None
+        try:
+            if length is None:
+                length = os.fstat(fd).st_size - offset
+            if _HAS_FADVISE and self.sequential:
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+            if self.use_mmap and length > 0:
+                chunks = self._mmap_chunks(fd, offset, length, block_size)
+            else:
+                chunks = self._read_chunks(fd, offset, length, block_size)
+            for chunk in chunks:
+                if self.cancel is not None and self.cancel.is_set():
+                    raise Cancelled()
+                yield chunk
+                if self.on_read:
+                    self.on_read(path, len(chunk))
+            if _HAS_FADVISE and self.drop_cache:
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+        finally:
+            if chunks is not None:
+                chunks.close()
+            os.close(fd)
+
+    def _open(self, path):
+        return os.open(path, _O_FLAGS)
+
+    def _read_chunks(self, fd, offset, length, block_size):
+        buffer = self._buffer()
+        with open(fd, "rb", buffering=0, closefd=False) as f:
+            f.seek(offset)
+            position = offset
+            end = offset + length
+            while position < end:
+                size = min(self.buffer_size, end - position)
+                if block_size:
+                    size = min(size, block_size - position % block_size)
+                read = f.readinto(buffer[:size])
+                if not read:
+                    break
+                position += read
+                yield buffer[:read]
+
+    def _mmap_chunks(self, fd, offset, length, block_size):
+        # Смещение отображения должно быть кратно гранулярности выделения памяти
+        map_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+        mapping = mmap.mmap(fd, length + offset - map_offset, access=mmap.ACCESS_READ, offset=map_offset)
+        try:
+            if self.sequential and hasattr(mapping, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapping.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapping)
+            try:
+                position = offset
+                end = offset + length
+                while position < end:
+                    size = min(self.buffer_size, end - position)
+                    if block_size:
+                        size = min(size, block_size - position % block_size)
+                    chunk = view[position - map_offset:position - map_offset + size]
+                    try:
+                        yield chunk
+                    finally:
+                        # Освобождаем кусок явно, даже если перебор прервали: иначе mmap не закрыть
+                        chunk.release()
+                    position += size
+            finally:
+                view.release()
+        finally:
+            mapping.close()
+
+    def hash_file(self, path, algorithm=DEFAULT_ALGORITHM, block_size=None, jobs=1):
+        # Хеш файла целиком. С block_size возвращает (хеш файла, [хеши блоков]) за один проход.
+        # У древовидного алгоритма хеши блоков - это листья, и с jobs > 1 они считаются параллельно.
+        if is_tree(algorithm) and block_size:
+            leaves = [digest for _, _, digest in self.block_digests(path, block_size, 0, algorithm, jobs)]
+            return tree_root(leaves, algorithm), leaves
+
+        file_hash = new_hash(algorithm)
+        if not block_size:
+            for chunk in self.chunks(path):
+                file_hash.update(chunk)
+            return file_hash.digest()
+
+        block_hashes = []
+        block_hash = new_hash(algorithm)
+        filled = 0
+        for chunk in self.chunks(path, block_size=block_size):
+            file_hash.update(chunk)
+            block_hash.update(chunk)
+            filled += len(chunk)
+            if filled == block_size:
+                block_hashes.append(block_hash.digest())
+                block_hash = new_hash(algorithm)
+                filled = 0
+        if filled:
+            block_hashes.append(block_hash.digest())
+        return file_hash.digest(), block_hashes
+
+    def block_digests(self, path, block_size, offset=0, algorithm=DEFAULT_ALGORITHM, jobs=1):
+        # Отдаёт (начало, конец, хеш) для каждого блока, начиная с offset (начала блока).
+        # Если остановить перебор раньше, оставшаяся часть файла не читается.
+        # С jobs > 1 блоки читаются и хешируются параллельно, отдаются всё равно по порядку.
+        if jobs > 1:
+            yield from self._parallel_block_digests(path, block_size, offset, algorithm, jobs)
+            return
+        block_hash = new_hash(algorithm)
+        start = position = offset
+        for chunk in self.chunks(path, offset, block_size=block_size):
+            block_hash.update(chunk)
+            position += len(chunk)
+            if position - start == block_size:
+                yield start, position, block_hash.digest()
+                block_hash = new_hash(algorithm)
+                start = position
+        if position > start:
+            yield start, position, block_hash.digest()
+
+    def _parallel_block_digests(self, path, block_size, offset, algorithm, jobs):
+        size = os.stat(path).st_size
+        starts = iter(range(offset, size, block_size))
+
+        def digest(start):
+            end = min(start + block_size, size)
+            block_hash = new_hash(algorithm)
+            for chunk in self.chunks(path, start, end - start):
+                block_hash.update(chunk)
+            return start, end, block_hash.digest()
+
+        # В работе держим не больше 2 * jobs блоков, чтобы ранняя остановка не читала лишнего
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        try:
+            pending = deque(executor.submit(digest, start) for _, start in zip(range(jobs * 2), starts))
+            while pending:
+                result = pending.popleft().result()
+                start = next(starts, None)
+                if start is not None:
+                    pending.append(executor.submit(digest, start))
+                yield result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def hash_regions(self, path, regions, algorithm=DEFAULT_ALGORITHM):
+        # Один хеш по участкам [(смещение, длина), ...] файла, взятым подряд
+        digest = new_hash(algorithm)
+        for offset, length in regions:
+            for chunk in self.chunks(path, offset, length):
+                digest.update(chunk)
+        return digest.digest()
+
+
+default_reader = HashReader()
+
+
+def sample_regions(size, sample_size, count=SAMPLE_COUNT):
+    # Участки для быстрой проверки: начало, конец и count участков, смещения которых зависят
+    # только от размера файла, так что при сборке манифеста и при проверке выбираются одни и те же.
+    # Небольшой файл проверяется целиком, и хеш его выборки совпадает с хешем файла.
+    if size <= sample_size * (count + 2):
+        return [(0, size)]
+    offsets = {0, size - sample_size}
+    for idx in range(count):
+        seed = hashlib.blake2b(f"{size}:{idx}".encode("ascii"), digest_size=8).digest()
+        offsets.add(int.from_bytes(seed, "little") % (size - sample_size))
+    return [(offset, sample_size) for offset in sorted(offsets)]
+
+
+def hash_file(path, algorithm=DEFAULT_ALGORITHM, block_size=None, reader=None, jobs=1):
+    return (reader or default_reader).hash_file(path, algorithm, block_size, jobs)
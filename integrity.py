@@ -0,0 +1,878 @@
+import os
+import sys
+import hashlib
+import time
+import json
+import stat
+import queue
+import fnmatch
+import ctypes
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import hashing
+import manifest
+
+
+# Сколько файлов хешировать одновременно на SSD и на неизвестном устройстве.
+# На HDD параллельное чтение только заставляет головку прыгать, поэтому там один поток.
+SSD_JOBS = 4
+UNKNOWN_JOBS = 2
+
+# Файлы, изменённые совсем недавно, в кэш не попадают: запись в пределах
+# разрешения mtime могла бы остаться незамеченной при следующей проверке
+CACHE_MIN_AGE = 2
+
+# Статусы проверки файла
+OK = "ok"
+MISSING = "missing"
+SIZE_MISMATCH = "size_mismatch"
+HASH_MISMATCH = "hash_mismatch"
+READ_ERROR = "read_error"
+NOT_A_FILE = "not_a_file"
+# Только для быстрой проверки: файл на месте и нужного размера, но сверить его содержимое
+# не с чем (в манифесте нет ни выборок, ни поблочных хешей). Повреждением не считается.
+NOT_SAMPLED = "not_sampled"
+
+# Что лежит в папке с игрой, но лишним не считается: сохранения и настройки игры,
+# деинсталлятор и служебные файлы этой утилиты. Шаблоны fnmatch по относительному пути.
+EXTRA_IGNORE = (
+    "UserData/*",
+    "BGI.gdb",
+    "unins*.exe",
+    "unins*.dat",
+    "*.tmp",
+    "repair/verify_cache.json",
+    "repair/verify_journal.json",
+    "repair/backup/*",
+    "integrity_trace.json",
+)
+
+_rotational_cache = {}
+
+
+def _is_rotational_windows(path):
+    # Спрашиваем у тома, есть ли у него штраф за позиционирование (IncursSeekPenalty)
+    from ctypes import wintypes
+
+    class STORAGE_PROPERTY_QUERY(ctypes.Structure):
+        _fields_ = [("PropertyId", wintypes.DWORD),
+                    ("QueryType", wintypes.DWORD),
+                    ("AdditionalParameters", wintypes.BYTE * 1)]
+
+    class DEVICE_SEEK_PENALTY_DESCRIPTOR(ctypes.Structure):
+        _fields_ = [("Version", wintypes.DWORD),
+                    ("Size", wintypes.DWORD),
+                    ("IncursSeekPenalty", wintypes.BOOLEAN)]
+
+    StorageDeviceSeekPenaltyProperty = 7
+    IOCTL_STORAGE_QUERY_PROPERTY = 0x002D1400
+    FILE_SHARE_READ_WRITE = 0x00000003
+    OPEN_EXISTING = 3
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+
+    drive = os.path.splitdrive(os.path.abspath(path))[0]
+    if not drive:
+        return None
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    handle = kernel32.CreateFileW(f"\\\\.\\{drive}", 0, FILE_SHARE_READ_WRITE, None, OPEN_EXISTING, 0, None)
+    if handle == INVALID_HANDLE_VALUE:
+        return None
+    try:
+        query = STORAGE_PROPERTY_QUERY(StorageDeviceSeekPenaltyProperty, 0)
+        descriptor = DEVICE_SEEK_PENALTY_DESCRIPTOR()
+        returned = wintypes.DWORD()
+        ok = kernel32.DeviceIoControl(handle, IOCTL_STORAGE_QUERY_PROPERTY,
+                                      ctypes.byref(query), ctypes.sizeof(query),
+                                      ctypes.byref(descriptor), ctypes.sizeof(descriptor),
+                                      ctypes.byref(returned), None)
+        if not ok:
+            return None
+        return bool(descriptor.IncursSeekPenalty)
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _is_rotational_linux(path):
+    st_dev = os.stat(path).st_dev
+    block_dir = Path(f"/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}")
+    # У раздела нет своей очереди, она лежит у родительского диска
+    for queue_dir in (block_dir / "queue", block_dir / ".." / "queue"):
+        flag = queue_dir / "rotational"
+        if flag.exists():
+            return flag.read_text().strip() == "1"
+    return None
+
+
+def is_rotational(path):
+    # True - HDD, False - SSD, None - определить не удалось
+    try:
+        key = os.stat(path).st_dev
+    except OSError:
+        return None
+    if key in _rotational_cache:
+        return _rotational_cache[key]
+
+    try:
+        if sys.platform == "win32":
+            result = _is_rotational_windows(path)
+        elif sys.platform.startswith("linux"):
+            result = _is_rotational_linux(path)
+        else:
+            result = None
+    except Exception:
+        result = None
+
+    _rotational_cache[key] = result
+    return result
+
+
+def pick_jobs(path):
+    rotational = is_rotational(path)
+    if rotational:
+        return 1
+    if rotational is None:
+        return UNKNOWN_JOBS
+    return min(SSD_JOBS, os.cpu_count() or 1)
+
+
+def _relative(file_path, root):
+    # Путь относительно root через "/". Пути из load_file_list начинаются с root и разбираются
+    # как строки, без создания Path на каждый файл.
+    file_path = os.fspath(file_path)
+    prefix = os.path.join(os.fspath(root), "")
+    if file_path.startswith(prefix):
+        rel_path = file_path[len(prefix):]
+        return rel_path if os.sep == "/" else rel_path.replace(os.sep, "/")
+    try:
+        return Path(file_path).relative_to(root).as_posix()
+    except ValueError:
+        return Path(file_path).as_posix()
+
+
+class VerifyCache:
+    # Кэш последних посчитанных хешей: относительный путь -> (размер, mtime, ID файла, хеш).
+    # Если у файла не изменились ни размер, ни время изменения, ни ID, хеш берётся из кэша.
+    # Хеши годятся только для того алгоритма, которым посчитаны: кэш другого алгоритма отбрасывается.
+    VERSION = 2
+
+    def __init__(self, cache_path, root, algorithm=hashing.DEFAULT_ALGORITHM):
+        self.cache_path = Path(cache_path)
+        self.root = Path(root)
+        self.algorithm = algorithm
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def key(self, file_path):
+        return _relative(file_path, self.root)
+
+    @staticmethod
+    def stamp(st):
+        return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+    def load(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # В кэше версии 1 хранились только MD5
+            algorithm = data.get("algorithm", "md5") if data.get("version") in (1, self.VERSION) else None
+            if algorithm == self.algorithm:
+                self.entries = data["files"]
+        except (OSError, ValueError, KeyError):
+            self.entries = {}
+        return self
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.cache_path.with_name(self.cache_path.name + ".tmp")
+        try:
+            with self.lock:
+                data = {"version": self.VERSION, "algorithm": self.algorithm, "files": self.entries}
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                self.dirty = False
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            self.dirty = self.dirty or bool(self.entries)
+            self.entries = {}
+
+    def lookup(self, file_path, st):
+        with self.lock:
+            entry = self.entries.get(self.key(file_path))
+        if entry and entry[:3] == self.stamp(st):
+            return bytes.fromhex(entry[3])
+        return None
+
+    def store(self, file_path, st, digest):
+        if time.time() - st.st_mtime < CACHE_MIN_AGE:
+            return
+        with self.lock:
+            self.entries[self.key(file_path)] = self.stamp(st) + [digest.hex()]
+            self.dirty = True
+
+
+def journal_key(file_list):
+    # Отпечаток манифеста: журнал от другого манифеста не подходит
+    key = hashlib.md5()
+    for file_path, expected_hash, expected_size, _ in file_list:
+        key.update(expected_hash)
+        key.update(expected_size.to_bytes(8, "little"))
+    return key.hexdigest()
+
+
+class CheckJournal:
+    # Журнал незавершённой проверки: вердикты уже проверенных файлов и смещение, до которого
+    # большой файл успели проверить поблочно. Записывается по ходу проверки (не чаще раза
+    # в SAVE_INTERVAL секунд) и при отмене, а после полной проверки удаляется, так что
+    # прерванная проверка в следующий раз продолжается с того же места.
+    VERSION = 1
+    SAVE_INTERVAL = 2.0
+
+    def __init__(self, journal_path, root, key):
+        self.journal_path = Path(journal_path)
+        self.root = Path(root)
+        self.key = key
+        self.verdicts = {}
+        self.offsets = {}
+        self.saved_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION and data.get("key") == self.key:
+                self.verdicts = data["verdicts"]
+                self.offsets = data["offsets"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return self
+
+    def clear(self):
+        with self.lock:
+            self.verdicts = {}
+            self.offsets = {}
+
+    def verdict(self, file_path, st):
+        # (статус, bad_ranges) из прошлого запуска, если файл с тех пор не менялся
+        with self.lock:
+            entry = self.verdicts.get(_relative(file_path, self.root))
+        if entry and entry[:3] == VerifyCache.stamp(st):
+            return entry[3], [tuple(bad_range) for bad_range in entry[4]]
+        return None
+
+    def set_verdict(self, file_path, st, status, bad_ranges):
+        key = _relative(file_path, self.root)
+        with self.lock:
+            self.verdicts[key] = VerifyCache.stamp(st) + [status, [list(bad_range) for bad_range in bad_ranges]]
+            self.offsets.pop(key, None)
+        self.save()
+
+    def resume_offset(self, file_path, st):
+        with self.lock:
+            entry = self.offsets.get(_relative(file_path, self.root))
+        if entry and entry[:3] == VerifyCache.stamp(st):
+            return entry[3]
+        return 0
+
+    def set_offset(self, file_path, st, offset):
+        with self.lock:
+            self.offsets[_relative(file_path, self.root)] = VerifyCache.stamp(st) + [offset]
+        self.save()
+
+    def save(self, force=False):
+        tmp_path = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        with self.lock:
+            if not force and time.monotonic() - self.saved_at < self.SAVE_INTERVAL:
+                return
+            self.saved_at = time.monotonic()
+            data = {"version": self.VERSION, "key": self.key, "verdicts": self.verdicts, "offsets": self.offsets}
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self.journal_path)
+            except OSError:
+                pass
+
+    def remove(self):
+        try:
+            self.journal_path.unlink()
+        except OSError:
+            pass
+
+
+class ProgressTracker:
+    # Прогресс длительной операции в байтах. Рабочие потоки только кладут события в очередь
+    # (on_read, file_done, set_inventory, finish), а поток интерфейса периодически вызывает drain(), который
+    # разом применяет всё накопившееся, и читает готовые значения.
+    RATE_WINDOW = 3.0
+
+    def __init__(self, total_bytes, total_files):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.done_bytes = 0
+        self.read_bytes = 0
+        self.done_files = 0
+        self.current_file = None
+        self.finished = False
+        self.result = None
+        self.inventory = None
+        self._events = queue.SimpleQueue()
+        self._read = {}
+        self._samples = deque([(time.monotonic(), 0, 0)])
+
+    def on_read(self, file_path, size):
+        self._events.put(("read", file_path, size))
+
+    def file_done(self, done, total, file_path, expected_size):
+        self._events.put(("file", file_path, expected_size))
+
+    def set_inventory(self, inventory):
+        # Опись папки готова раньше хешей: отсутствующие и лишние файлы можно показать сразу
+        self._events.put(("inventory", inventory, None))
+
+    def finish(self, result=None):
+        self._events.put(("finish", result, None))
+
+    def drain(self):
+        while True:
+            try:
+                kind, value, size = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "read":
+                self.done_bytes += size
+                self.read_bytes += size
+                self._read[value] = self._read.get(value, 0) + size
+            elif kind == "file":
+                # Файл готов: досчитываем то, что не читалось (кэш, ранний выход, отсутствующий файл)
+                file_path, expected_size = value, size
+                self.done_bytes += max(0, expected_size - self._read.pop(file_path, 0))
+                self.done_files += 1
+                self.current_file = file_path
+            elif kind == "inventory":
+                self.inventory = value
+            else:
+                self.finished = True
+                self.result = value
+
+        now = time.monotonic()
+        self._samples.append((now, self.done_bytes, self.read_bytes))
+        while len(self._samples) > 2 and now - self._samples[1][0] > self.RATE_WINDOW:
+            self._samples.popleft()
+        return self
+
+    def _speed(self, field):
+        first, last = self._samples[0], self._samples[-1]
+        if last[0] - first[0] <= 0:
+            return 0.0
+        return (last[field] - first[field]) / (last[0] - first[0])
+
+    def rate(self):
+        # Скорость чтения с диска, байт в секунду за последние несколько секунд
+        return self._speed(2)
+
+    def eta(self):
+        # Оставшееся время в секундах или None, пока скорость неизвестна.
+        # Считается по общему продвижению, включая файлы, которые не пришлось читать.
+        speed = self._speed(1)
+        if speed <= 0:
+            return None
+        return max(0, self.total_bytes - self.done_bytes) / speed
+
+
+def check_blocks(file_path, block_size, block_hashes, stop_at_first=True, offset=0, reader=None, on_block=None,
+                 algorithm=hashing.DEFAULT_ALGORITHM, jobs=1):
+    # Сверяет файл поблочно и возвращает список повреждённых участков [(начало, конец), ...].
+    # С stop_at_first чтение прекращается на первом несовпавшем блоке.
+    # offset - с какого байта (начала блока) начинать, block_hashes тогда начинаются с этого блока.
+    # on_block(конец) вызывается, пока все проверенные блоки совпадают, - до какого места файл цел.
+    # jobs > 1 - блоки одного файла хешируются параллельно (см. HashReader.block_digests).
+    bad_ranges = []
+    blocks = (reader or hashing.default_reader).block_digests(file_path, block_size, offset, algorithm, jobs)
+    for expected, (start, end, digest) in zip(block_hashes, blocks):
+        if digest != expected:
+            bad_ranges.append((start, end))
+            if stop_at_first:
+                break
+        elif on_block and not bad_ranges:
+            on_block(end)
+    return bad_ranges
+
+
+def format_ranges(bad_ranges):
+    mib = 1024 * 1024
+    return ", ".join(f"{start / mib:.0f}-{end / mib:.0f} МиБ" for start, end in bad_ranges)
+
+
+def compute_file_hash(file_path, reader=None, algorithm=hashing.DEFAULT_ALGORITHM):
+    # Хеш файла без поблочных хешей: у древовидного алгоритма такой файл - один лист
+    try:
+        return hashing.hash_file(file_path, algorithm, reader=reader)
+    except OSError:
+        return None
+
+
+class FileList(list):
+    # Список записей манифеста, который помнит алгоритм хеширования этого манифеста
+    def __init__(self, entries=(), algorithm=hashing.DEFAULT_ALGORITHM):
+        super().__init__(entries)
+        self.algorithm = algorithm
+
+
+def _algorithm(file_list, algorithm):
+    return algorithm or getattr(file_list, "algorithm", hashing.DEFAULT_ALGORITHM)
+
+
+def load_file_list(manifest_path, root):
+    # Записи манифеста с путями внутри root:
+    # [(file_path, expected_hash, expected_size, blocks), ...], blocks - None или (размер блока, [хеши блоков]).
+    # file_path - строка (root плюс относительный путь с разделителями ОС): Path на каждую запись
+    # не создаётся, все функции модуля принимают и строки, и Path.
+    # Возвращает FileList, в algorithm - алгоритм из заголовка манифеста (у старых манифестов MD5).
+    prefix = os.path.join(os.fspath(root), "")
+    with manifest.Manifest.load(manifest_path) as file_manifest:
+        file_list = FileList(algorithm=file_manifest.algorithm)
+        block_size = file_manifest.block_size
+        for rel_path, digest, size, _, block_hashes in file_manifest:
+            if os.sep != "/":
+                rel_path = rel_path.replace("/", os.sep)
+            file_list.append((prefix + rel_path, digest, size, (block_size, block_hashes) if block_hashes else None))
+    return file_list
+
+
+def load_samples(manifest_path):
+    # (размер выборки, [хеши выборок в порядке манифеста]) или None, если в манифесте их нет
+    with manifest.Manifest.load(manifest_path) as file_manifest:
+        if not file_manifest.sample_size:
+            return None
+        return file_manifest.sample_size, [file_manifest.sample(idx) for idx in range(len(file_manifest))]
+
+
+def check_sample(file_path, expected_hash, expected_size, blocks, sample=None, sample_size=0, reader=None,
+                 algorithm=hashing.DEFAULT_ALGORITHM):
+    # Быстрая проверка содержимого: True, если выборочные участки файла совпали.
+    # Без выборок в манифесте у больших файлов сверяются первый и последний блоки.
+    # None - сверять нечего: файл пришлось бы читать целиком, а это уже полная проверка.
+    reader = reader or hashing.default_reader
+    if sample is not None:
+        regions = hashing.sample_regions(expected_size, sample_size)
+        return reader.hash_regions(file_path, regions, algorithm) == sample
+    if blocks:
+        block_size, block_hashes = blocks
+        last = len(block_hashes) - 1
+        return not (check_blocks(file_path, block_size, block_hashes[:1], reader=reader, algorithm=algorithm)
+                    or check_blocks(file_path, block_size, block_hashes[last:], offset=last * block_size,
+                                    reader=reader, algorithm=algorithm))
+    return None
+
+
+class Inventory:
+    # Результат одного прохода scandir по папке с игрой, сопоставленный с манифестом.
+    # stats - stat каждой записи file_list (None - файла нет), его принимают iter_check и check_files.
+    # missing, wrong_type, size_mismatch - индексы записей; extra - относительные пути лишних файлов.
+
+    def __init__(self, stats, missing, wrong_type, size_mismatch, extra):
+        self.stats = stats
+        self.missing = missing
+        self.wrong_type = wrong_type
+        self.size_mismatch = size_mismatch
+        self.extra = extra
+
+
+def _scan_tree(directory, prefix, ignore, found):
+    # Собирает {нормализованный относительный путь: (относительный путь, stat)} по всему дереву.
+    # Папки, подпадающие под ignore целиком, не обходятся.
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError:
+        return
+    for entry in entries:
+        rel_path = prefix + entry.name
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        found[os.path.normcase(rel_path)] = (rel_path, st)
+        if entry.is_dir(follow_symlinks=False) and not _ignored(rel_path + "/*", ignore):
+            _scan_tree(entry.path, rel_path + "/", ignore, found)
+
+
+def _ignored(rel_path, ignore):
+    rel_path = os.path.normcase(rel_path)
+    return any(fnmatch.fnmatchcase(rel_path, os.path.normcase(pattern)) for pattern in ignore)
+
+
+def take_inventory(root, file_list, ignore=EXTRA_IGNORE):
+    # Один проход scandir по root: stat всех файлов разом (на Windows его отдаёт само чтение
+    # папки), затем сопоставление с манифестом. Хешировать для этого ничего не нужно.
+    # ignore - шаблоны путей, которые не считаются лишними файлами.
+    root = Path(root)
+    found = {}
+    _scan_tree(root, "", ignore, found)
+
+    stats = []
+    missing, wrong_type, size_mismatch = [], [], []
+    expected = set()
+    for idx, (file_path, _, expected_size, _) in enumerate(file_list):
+        key = os.path.normcase(_relative(file_path, root))
+        expected.add(key)
+        st = found.get(key, (None, None))[1]
+        stats.append(st)
+        if st is None:
+            missing.append(idx)
+        elif not stat.S_ISREG(st.st_mode):
+            wrong_type.append(idx)
+        elif st.st_size != expected_size:
+            size_mismatch.append(idx)
+
+    # Лишними считаются только файлы: папки сами по себе ничему не мешают
+    extra = sorted(rel_path for key, (rel_path, st) in found.items()
+                   if key not in expected and not stat.S_ISDIR(st.st_mode) and not _ignored(rel_path, ignore))
+    return Inventory(stats, missing, wrong_type, size_mismatch, extra)
+
+
+def _file_stat(idx, file_path, stats, need_id=False):
+    # stat файла из take_inventory, а без инвентаризации - с диска. None - файла нет.
+    # need_id - нужен настоящий ID файла (он входит в ключ кэша и журнала). У DirEntry.stat()
+    # на Windows st_ino всегда 0, тогда файл stat-ится заново: это один вызов на файл.
+    if stats is not None:
+        st = stats[idx]
+        if st is None or st.st_ino or not need_id:
+            return st
+    try:
+        return os.stat(file_path)
+    except OSError:
+        return None
+
+
+def _stat_verdicts(file_list, stats, need_id):
+    # Что видно по одному stat, без чтения файлов: ([(индекс, статус)] отсутствующих, не файлов
+    # и файлов не того размера, [(индекс, stat)] остальных, которые надо хешировать)
+    verdicts = []
+    pending = []
+    for idx, (file_path, _, expected_size, _) in enumerate(file_list):
+        st = _file_stat(idx, file_path, stats, need_id)
+        if st is None:
+            verdicts.append((idx, MISSING))
+        elif not stat.S_ISREG(st.st_mode):
+            verdicts.append((idx, NOT_A_FILE))
+        elif st.st_size != expected_size:
+            verdicts.append((idx, SIZE_MISMATCH))
+        else:
+            pending.append((idx, st))
+    return verdicts, pending
+
+
+def iter_check(file_list, hash_func=None, jobs=None, cache=None, stop_at_first=True, reader=None,
+               journal=None, cancel=None, stats=None, algorithm=None, block_jobs=1):
+    # Проверяет файлы пулом потоков и отдаёт (индекс в file_list, статус, bad_ranges)
+    # по мере готовности, то есть не в порядке манифеста. Отсутствующие файлы и файлы не того
+    # размера отдаются первыми, до того как начнётся хеширование.
+    # cache: необязательный VerifyCache, неизменённые файлы из него не перечитываются.
+    # reader: HashReader для чтения файлов, по умолчанию общий.
+    # journal: необязательный CheckJournal, по которому продолжается прерванная проверка.
+    # cancel: threading.Event того же reader. Если перебор прерван (исключением, отменой
+    # или закрытием генератора), он устанавливается, чтобы рабочие потоки остановились сразу.
+    # Отмена через reader.cancel завершает перебор исключением hashing.Cancelled.
+    # stats: Inventory.stats, чтобы не делать stat каждого файла повторно.
+    # algorithm: алгоритм хешей манифеста, по умолчанию file_list.algorithm.
+    # block_jobs: сколько блоков одного большого файла хешировать параллельно. Это часть того же
+    # бюджета jobs, а не добавка к нему: файлов одновременно проверяется jobs // block_jobs,
+    # так что с диска никогда не читается больше jobs потоков сразу.
+    if not file_list:
+        return
+    algorithm = _algorithm(file_list, algorithm)
+    if hash_func is None:
+        hash_func = lambda file_path: compute_file_hash(file_path, reader, algorithm)
+    if jobs is None:
+        jobs = pick_jobs(os.path.dirname(file_list[0][0]))
+    block_jobs = max(1, min(block_jobs, jobs))
+    file_jobs = max(1, jobs // block_jobs)
+
+    def check(file_path, expected_hash, blocks, st):
+        digest = cache.lookup(file_path, st) if cache else None
+        if digest is None:
+            if blocks:
+                block_size, block_hashes = blocks
+                offset = journal.resume_offset(file_path, st) if journal else 0
+                on_block = (lambda end: journal.set_offset(file_path, st, end)) if journal else None
+                try:
+                    bad_ranges = check_blocks(file_path, block_size, block_hashes[offset // block_size:],
+                                              stop_at_first, offset, reader, on_block, algorithm, block_jobs)
+                except OSError:
+                    return READ_ERROR, []
+                if bad_ranges:
+                    return HASH_MISMATCH, bad_ranges
+                # Все блоки совпали, значит совпадает и файл целиком
+                digest = expected_hash
+            else:
+                digest = hash_func(file_path)
+                if digest is None:
+                    return READ_ERROR, []
+            # Если файл менялся прямо во время чтения, такой хеш не кэшируем
+            if cache:
+                try:
+                    if VerifyCache.stamp(os.stat(file_path)) == VerifyCache.stamp(st):
+                        cache.store(file_path, st, digest)
+                except OSError:
+                    pass
+        return (OK if digest == expected_hash else HASH_MISMATCH), []
+
+    def verify(idx):
+        file_path, expected_hash, _, blocks = file_list[idx]
+        st = pending_stats[idx]
+        result = journal.verdict(file_path, st) if journal else None
+        if result is None:
+            result = check(file_path, expected_hash, blocks, st)
+            if journal:
+                journal.set_verdict(file_path, st, *result)
+        return result
+
+    # Файл другого размера не может совпасть по хешу, читать его незачем
+    verdicts, pending = _stat_verdicts(file_list, stats, cache is not None or journal is not None)
+    pending_stats = dict(pending)
+    # Большие архивы ставим в очередь первыми, чтобы в конце не ждать один длинный файл
+    order = sorted(pending_stats, key=lambda i: file_list[i][2], reverse=True)
+
+    completed = False
+    try:
+        for idx, status in verdicts:
+            yield idx, status, []
+        with ThreadPoolExecutor(max_workers=file_jobs) as executor:
+            futures = {executor.submit(verify, idx): idx for idx in order}
+            try:
+                for future in as_completed(futures):
+                    yield (futures[future], *future.result())
+                completed = True
+            finally:
+                if not completed and cancel is not None:
+                    cancel.set()
+                for future in futures:
+                    future.cancel()
+    finally:
+        # Сюда попадаем, когда все рабочие потоки уже остановились
+        if cache:
+            cache.save()
+        if journal:
+            if completed:
+                journal.remove()
+            else:
+                journal.save(force=True)
+
+
+def iter_quick_check(file_list, samples=None, jobs=None, cache=None, stop_at_first=True, reader=None, cancel=None,
+                     stats=None, algorithm=None, block_jobs=1):
+    # Быстрая проверка, отдаёт то же, что iter_check. Сначала за один проход stat отмечаются
+    # отсутствующие файлы и файлы не того размера, затем у остальных хешируются только
+    # выборочные участки (samples - результат load_samples). Файлы, чьи выборки не совпали,
+    # проверяются полностью, так что их статус и bad_ranges такие же, как у полной проверки.
+    # Совпадение выборок не гарантирует, что файл цел целиком. Файлы, для которых в манифесте
+    # нет ни выборок, ни хешей блоков, не читаются и получают статус NOT_SAMPLED.
+    algorithm = _algorithm(file_list, algorithm)
+    sample_size, sample_digests = samples or (0, None)
+    verdicts, pending = _stat_verdicts(file_list, stats, cache is not None)
+    for idx, status in verdicts:
+        yield idx, status, []
+    if not pending:
+        return
+    if jobs is None:
+        jobs = pick_jobs(os.path.dirname(file_list[0][0]))
+
+    def triage(idx, st):
+        # Статус файла или None - нужна полная проверка
+        file_path, expected_hash, expected_size, blocks = file_list[idx]
+        digest = cache.lookup(file_path, st) if cache else None
+        if digest is not None:
+            return OK if digest == expected_hash else HASH_MISMATCH
+        sample = sample_digests[idx] if sample_digests else None
+        try:
+            matched = check_sample(file_path, expected_hash, expected_size, blocks, sample, sample_size, reader, algorithm)
+        except OSError:
+            return None
+        if matched is None:
+            return NOT_SAMPLED
+        return OK if matched else None
+
+    suspicious = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(triage, idx, st): idx for idx, st in pending}
+        completed = False
+        try:
+            for future in as_completed(futures):
+                status = future.result()
+                if status is None:
+                    suspicious.append(futures[future])
+                else:
+                    yield futures[future], status, []
+            completed = True
+        finally:
+            if not completed and cancel is not None:
+                cancel.set()
+            for future in futures:
+                future.cancel()
+
+    # Кэш здесь только читается, а посчитанные при полной проверке хеши сохраняет iter_check
+    suspicious.sort()
+    pending_stats = dict(pending)
+    checks = iter_check([file_list[idx] for idx in suspicious], jobs=jobs, cache=cache, stop_at_first=stop_at_first,
+                        reader=reader, cancel=cancel, stats=[pending_stats[idx] for idx in suspicious],
+                        algorithm=algorithm, block_jobs=block_jobs)
+    for idx, status, bad_ranges in checks:
+        yield suspicious[idx], status, bad_ranges
+
+
+def check_files(file_list, hash_func=None, jobs=None, on_progress=None, cache=None, stop_at_first=True, reader=None,
+                journal=None, cancel=None, quick=False, samples=None, stats=None, algorithm=None, block_jobs=1):
+    # file_list: [(file_path, expected_hash, expected_size, blocks), ...] в порядке манифеста,
+    # expected_hash - хеш в виде bytes, blocks - None или (размер блока, [хеши блоков]).
+    # Возвращает [(file_path, статус, bad_ranges), ...] в том же порядке.
+    # on_progress(done, total, file_path, expected_size) вызывается из вызывающего потока
+    # по мере готовности файлов, например ProgressTracker.file_done.
+    # quick - быстрая проверка по выборкам samples (см. iter_quick_check), hash_func и journal тогда не нужны.
+    # stats - Inventory.stats из take_inventory, тогда файлы повторно не stat-ятся.
+    # algorithm, block_jobs - как у iter_check.
+    total = len(file_list)
+    results = [None] * total
+    if quick:
+        checks = iter_quick_check(file_list, samples, jobs, cache, stop_at_first, reader, cancel, stats,
+                                  algorithm, block_jobs)
+    else:
+        checks = iter_check(file_list, hash_func, jobs, cache, stop_at_first, reader, journal, cancel, stats,
+                            algorithm, block_jobs)
+    for done, (idx, status, bad_ranges) in enumerate(checks, 1):
+        file_path, _, expected_size, _ = file_list[idx]
+        results[idx] = (file_path, status, bad_ranges)
+        if on_progress:
+            on_progress(done, total, file_path, expected_size)
+    return results
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_ERROR = 2
+EXIT_CANCELLED = 130
+
+
+def run_verify(args):
+    root = Path(args.root).resolve()
+    try:
+        file_list = load_file_list(args.manifest, root)
+    except Exception as e:
+        print(f"Cannot load manifest {args.manifest}: {e}", file=sys.stderr)
+        return EXIT_ERROR
+
+    cache = VerifyCache(args.cache, root, file_list.algorithm).load() if args.cache else None
+    journal = CheckJournal(args.journal, root, journal_key(file_list)).load() if args.journal else None
+    cancel = threading.Event()
+    trace = None
+    if args.trace:
+        import tracing
+        trace = tracing.CheckTrace(root)
+        reader = tracing.TracingReader(trace, buffer_size=args.buffer_size, use_mmap=args.mmap,
+                                       drop_cache=args.drop_cache, cancel=cancel)
+    else:
+        reader = hashing.HashReader(buffer_size=args.buffer_size, use_mmap=args.mmap, drop_cache=args.drop_cache,
+                                    cancel=cancel)
+    counts = {}
+    failed_size = 0
+
+    # Отсутствующие, лишние файлы и файлы не того размера видны ещё до хеширования
+    inventory = take_inventory(root, file_list, EXTRA_IGNORE + (_relative(Path(args.manifest).resolve(), root),))
+    for rel_path in inventory.extra:
+        if args.json:
+            print(json.dumps({"path": rel_path, "status": "extra"}), flush=True)
+        else:
+            print(f"extra: {rel_path}", flush=True)
+
+    if args.quick:
+        checks = iter_quick_check(file_list, load_samples(args.manifest), jobs=args.jobs, cache=cache,
+                                  stop_at_first=not args.all_ranges, reader=reader, cancel=cancel,
+                                  stats=inventory.stats, block_jobs=args.block_jobs)
+    else:
+        checks = iter_check(file_list, jobs=args.jobs, cache=cache, stop_at_first=not args.all_ranges, reader=reader,
+                            journal=journal, cancel=cancel, stats=inventory.stats, block_jobs=args.block_jobs)
+    try:
+        for idx, status, bad_ranges in checks:
+            file_path, _, expected_size, _ = file_list[idx]
+            rel_path = _relative(file_path, root)
+            counts[status] = counts.get(status, 0) + 1
+            if status not in (OK, NOT_SAMPLED):
+                failed_size += expected_size
+            if args.json:
+                print(json.dumps({"index": idx, "path": rel_path, "status": status, "size": expected_size,
+                                  "bad_ranges": [list(bad_range) for bad_range in bad_ranges]}), flush=True)
+            elif status not in (OK, NOT_SAMPLED):
+                ranges = " (" + ", ".join(f"{start}-{end}" for start, end in bad_ranges) + ")" if bad_ranges else ""
+                print(f"{status}: {rel_path}{ranges}", flush=True)
+    except KeyboardInterrupt:
+        if journal:
+            print(f"Interrupted, progress saved to {args.journal}.", file=sys.stderr)
+        return EXIT_CANCELLED
+
+    not_sampled = counts.get(NOT_SAMPLED, 0)
+    failed = len(file_list) - counts.get(OK, 0) - not_sampled
+    if args.json:
+        print(json.dumps({"summary": {"files": len(file_list), "failed": failed, "failed_size": failed_size,
+                                      "statuses": counts, "extra": len(inventory.extra)}}), flush=True)
+    else:
+        print(f"Checked {len(file_list)} files, {failed} failed, {len(inventory.extra)} extra.")
+        if not_sampled:
+            print(f"{not_sampled} files have no sampled regions in the manifest, their content was not checked; "
+                  "run a full check.")
+    if trace:
+        trace.write(args.trace, jobs=args.jobs, buffer_size=args.buffer_size, mmap=args.mmap,
+                    algorithm=file_list.algorithm, block_jobs=args.block_jobs)
+    return EXIT_FAILED if failed else EXIT_OK
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="integrity", description="Sakura no Uta install integrity tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    verify = commands.add_parser(
+        "verify", help="verify an install against a manifest",
+        description=f"Exit codes: {EXIT_OK} - all files ok, {EXIT_FAILED} - some files failed, "
+                    f"{EXIT_ERROR} - the check could not run, {EXIT_CANCELLED} - interrupted. "
+                    "Extra files are reported but do not fail the check.")
+    verify.add_argument("--root", default=".", help="game install directory (default: current directory)")
+    verify.add_argument("--manifest", default=str(Path(__file__).resolve().parent / "file_hashes.bin"),
+                        help="manifest file (default: file_hashes.bin next to this script)")
+    verify.add_argument("--jobs", type=int, default=None, help="files hashed in parallel (default: by disk type)")
+    verify.add_argument("--block-jobs", type=int, default=1,
+                        help="blocks of one large file hashed in parallel, taken out of --jobs (default: 1)")
+    verify.add_argument("--json", action="store_true", help="print one JSON object per file, then a summary")
+    verify.add_argument("--cache", default=None, help="verification cache file to read and update")
+    verify.add_argument("--all-ranges", action="store_true",
+                        help="report every damaged block instead of stopping at the first one")
+    verify.add_argument("--buffer-size", type=int, default=hashing.DEFAULT_BUFFER_SIZE, help="read buffer size in bytes")
+    verify.add_argument("--mmap", action="store_true", help="read files through mmap")
+    verify.add_argument("--drop-cache", action="store_true",
+                        help="evict checked files from the OS page cache (Linux), so a full check of a big "
+                             "install does not push everything else out of memory")
+    verify.add_argument("--trace", default=None, help="write per-file timings to this file")
+    verify.add_argument("--quick", action="store_true",
+                        help="stat every file and hash only sampled regions, fully hashing files that look damaged")
+    verify.add_argument("--journal", default=None,
+                        help="checkpoint file: an interrupted full check resumes from it on the next run")
+    verify.set_defaults(func=run_verify)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,54 @@
 import os
 import sys
 import threading
-import hashlib
-import ctypes
+import time
 import tkinter as tk
 from tkinter import ttk, messagebox, PhotoImage
-import winreg
-import shutil
 from pathlib import Path
-import pickle
-import locale
-import webbrowser
+
+# Модули проверок (hashing, integrity, diagnostics, repair и т.д.) импортируются в методах,
+# которые ими пользуются, чтобы окно появлялось сразу, а не после загрузки всего подряд.
+
+# Как часто (в мс) интерфейс забирает накопившиеся события прогресса из рабочего потока
+PROGRESS_INTERVAL_MS = 100
+
+# Файл с замерами проверки целостности (см. tracing.py)
+TRACE_FILE_NAME = "integrity_trace.json"
+
+# Сколько лишних файлов перечислять в сообщении
+EXTRA_FILES_SHOWN = 20
+
+# Если переменная окружения задана, утилита закрывается, как только появится окно
+# (так benchmarks/bench_startup.py замеряет время запуска)
+EXIT_AFTER_START_ENV = "SAKUUTA_EXIT_AFTER_START"
 
 
 def resource_path(relative_path):
+    # Ресурсы лежат внутри собранного exe, а при запуске из исходников - рядом с main.py,
+    # откуда бы его ни запустили (папка с игрой - это текущая папка, а не папка утилиты)
     try:
         base_path = Path(sys._MEIPASS)
     except AttributeError:
-        base_path = Path.cwd()
+        base_path = Path(__file__).resolve().parent
     return base_path / relative_path
 
+# Картинки подсказок, уже загруженные в PhotoImage: путь -> картинка или None, если файла нет
+_tooltip_images = {}
+
+
+def load_tooltip_image(image_path):
+    # PNG декодируется при первом наведении, а дальше берётся готовым
+    if image_path not in _tooltip_images:
+        _tooltip_images[image_path] = PhotoImage(file=str(image_path)) if image_path.exists() else None
+    return _tooltip_images[image_path]
+
+
 class Tooltip:
     def __init__(self, widget, text, image_path=None):
         self.widget = widget
         self.text = text
-        self.image_path = Path.cwd() / 'repair' / image_path if image_path else None
+        # Картинки лежат рядом с утилитой (или внутри exe), путь к ним даёт resource_path
+        self.image_path = Path(image_path) if image_path else None
         self.tooltip_window = None
 
         widget.bind("<Enter>", self.show_tooltip)
@@ -46,10 +70,9 @@ class Tooltip:
         frame.pack()
 
         # Если есть изображение, загружаем и добавляем его без фиксированной ширины
-        if self.image_path and self.image_path.exists():
-            image = PhotoImage(file=str(self.image_path))
+        image = load_tooltip_image(self.image_path) if self.image_path else None
+        if image is not None:
             img_label = tk.Label(frame, image=image, anchor="center", pady=15, padx=10)
-            img_label.image = image  # сохраняем ссылку на изображение
             img_label.pack(side="top")
             label = tk.Label(frame, text=self.text, background="gray99", relief="solid", borderwidth=0, pady=10, padx=10)
             label.pack(side="top")
@@ -81,7 +104,20 @@ class App(tk.Tk):
         self.grid()
         self.resizable(False, False)
         self.repair_dir = Path.cwd() / 'repair'
+        self._probe = None
+        self._file_list = None
+        self._samples = None
+        self._manifest = None
+        self.cancel_event = threading.Event()
         self.create_widgets()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    @property
+    def probe(self):
+        if self._probe is None:
+            import diagnostics
+            self._probe = diagnostics.WindowsProbe()
+        return self._probe
 
     def create_widgets(self):
         info_label = ttk.Label(self, text="Данная утилита поможет вам обнаружить и устранить возможные неполадки с установленной игрой.")
@@ -92,6 +128,23 @@ class App(tk.Tk):
         self.check_integrity_button.pack(pady=5)
         Tooltip(self.check_integrity_button, "Если игра не запускается или некорректно работает, есть смысл проверить, все ли файлы целы.\nЭта опция запускает проверку целостности всех файлов, сравнивая их по хеш-сумме MD5.\nСкорость проверки зависит от скорости диска.")
 
+        # Кнопка для быстрой проверки по выборочным участкам файлов
+        self.quick_check_button = ttk.Button(self, text="Быстрая проверка", command=self.quick_check)
+        self.quick_check_button.pack(pady=5)
+        Tooltip(self.quick_check_button, "Проверяет, что все файлы на месте и нужного размера, и сверяет только несколько участков каждого файла.\nЗанимает секунды. Подозрительные файлы проверяются полностью.\nЕсли быстрая проверка ничего не нашла, а проблемы остались, запустите полную проверку.")
+
+        # Флажок для принудительной полной перепроверки без кэша
+        self.force_rehash = tk.BooleanVar(value=False)
+        self.force_rehash_check = ttk.Checkbutton(self, text="Перепроверить все файлы заново", variable=self.force_rehash)
+        self.force_rehash_check.pack()
+        Tooltip(self.force_rehash_check, "Результаты прошлых проверок запоминаются, и файлы, которые с тех пор не менялись, повторно не читаются.\nОтметьте, чтобы заново прочитать и проверить все файлы.")
+
+        # Флажок для записи замеров проверки, которые можно приложить к сообщению об ошибке
+        self.write_trace = tk.BooleanVar(value=False)
+        self.write_trace_check = ttk.Checkbutton(self, text="Записать журнал замеров проверки", variable=self.write_trace)
+        self.write_trace_check.pack()
+        Tooltip(self.write_trace_check, f"Во время проверки для каждого файла замеряется время открытия, чтения и хеширования.\nЖурнал сохраняется в файл '{TRACE_FILE_NAME}' в папке с игрой.\nЕсли проверка идёт подозрительно долго, приложите этот файл к сообщению об ошибке.")
+
         # Кнопка для проверки шрифта
         self.check_font_button = ttk.Button(self, text="Починить отображение текста (крякозябры в игре)", command=self.fix_font)
         self.check_font_button.pack(pady=5)
@@ -121,6 +174,11 @@ class App(tk.Tk):
         self.status_label = ttk.Label(self, text="")
         self.status_label.pack()
 
+        # Кнопка для отмены идущей проверки, активна только во время проверки
+        self.cancel_button = ttk.Button(self, text="Отменить проверку", command=self.cancel_check, state="disabled")
+        self.cancel_button.pack(pady=5)
+        Tooltip(self.cancel_button, "Останавливает проверку целостности.\nПри полной проверке уже проверенное запоминается, и в следующий раз она продолжится с того же места.")
+
         # Toggle button to show/hide info_label2
         self.toggle_button = ttk.Button(self, text="Ничего не работает", command=self.toggle_info_label2)
         self.toggle_button.pack(pady=10)
@@ -154,42 +212,255 @@ class App(tk.Tk):
             self.toggle_button.config(text="Скрыть")
 
     def check_integrity(self):
-        threading.Thread(target=self._check_integrity_thread).start()
-
-    def _check_integrity_thread(self):
         self.perform_integrity_check()
 
-    def perform_integrity_check(self):
+    def quick_check(self):
+        self.perform_integrity_check(quick=True)
+
+    def cancel_check(self):
+        self.cancel_event.set()
+        self.cancel_button.config(state="disabled")
+
+    def on_close(self):
+        # Останавливаем проверку, чтобы её поток записал журнал и не держал процесс после закрытия окна
+        self.cancel_event.set()
+        if self._manifest:
+            self._manifest.close()
+        self.destroy()
+
+    def relative(self, file_path):
+        try:
+            return Path(file_path).relative_to(Path.cwd())
+        except ValueError:
+            return file_path
+
+    def run_in_background(self, task, tracker, on_finish, action, trace=None, cancellable=False, on_failed=None):
+        # task() выполняется в отдельном потоке и сообщает о прогрессе только через tracker.
+        # Виджеты обновляются из главного потока по таймеру, on_finish(результат) - тоже.
+        # trace - необязательный tracing.CheckTrace, в который записывается время обновления интерфейса.
+        # cancellable - task останавливается по self.cancel_event, пока она идёт, доступна кнопка отмены.
+        # on_failed(исключение) - вызывается вместо on_finish, если task отменили или она упала.
+        if cancellable:
+            self.cancel_button.config(state="normal")
+        # Пока операция идёт, новую проверку не запустить: она заменила бы cancel_event
+        # и писала бы в тот же кэш и журнал
+        self.set_checks_enabled(False)
+        def worker():
+            try:
+                result = task()
+            except Exception as e:
+                result = e
+            tracker.finish(result)
+
+        threading.Thread(target=worker).start()
+        self.after(PROGRESS_INTERVAL_MS, self.poll_progress, tracker, on_finish, action, trace, on_failed)
+
+    def poll_progress(self, tracker, on_finish, action, trace=None, on_failed=None):
+        import hashing
+        started = time.perf_counter()
+        # Разом применяем все накопившиеся события, сколько бы их ни пришло с прошлого раза
+        tracker.drain()
+        self.progress["maximum"] = max(tracker.total_bytes, 1)
+        self.progress["value"] = tracker.done_bytes
+        self.status_label.config(text=self.format_progress(tracker, action))
+        if trace:
+            trace.add_ui_time(time.perf_counter() - started)
+
+        if not tracker.finished:
+            self.after(PROGRESS_INTERVAL_MS, self.poll_progress, tracker, on_finish, action, trace, on_failed)
+            return
+
+        self.status_label.config(text="")
+        self.progress["value"] = 0
+        self.cancel_button.config(state="disabled")
+        self.set_checks_enabled(True)
+        if isinstance(tracker.result, hashing.Cancelled):
+            self.status_label.config(text="Проверка отменена.")
+        elif isinstance(tracker.result, Exception):
+            messagebox.showerror("Ошибка", f"Операция прервана из-за ошибки:\n{tracker.result}")
+        else:
+            on_finish(tracker.result)
+            return
+        if on_failed:
+            on_failed(tracker.result)
+
+    def set_checks_enabled(self, enabled):
+        state = "normal" if enabled else "disabled"
+        for button in (self.check_integrity_button, self.quick_check_button, self.check_all_button):
+            button.config(state=state)
+
+    def format_progress(self, tracker, action):
+        mb = 1024 * 1024
+        text = f"{action} ({tracker.done_files}/{tracker.total_files})"
+        if tracker.current_file is not None:
+            text = f"{action}: {self.relative(tracker.current_file)} ({tracker.done_files}/{tracker.total_files})"
+        text += f"\n{tracker.done_bytes / mb:.0f} из {tracker.total_bytes / mb:.0f} МБ"
+        rate = tracker.rate()
+        if rate > 0:
+            text += f", {rate / mb:.1f} МБ/с"
+        eta = tracker.eta()
+        if eta is not None and tracker.done_files < tracker.total_files:
+            minutes, seconds = divmod(int(eta), 60)
+            text += f", осталось около {minutes}:{seconds:02d}"
+        inventory = tracker.inventory
+        if inventory is not None:
+            counts = [("отсутствует", len(inventory.missing)), ("не файл", len(inventory.wrong_type)),
+                      ("другой размер", len(inventory.size_mismatch)), ("лишних", len(inventory.extra))]
+            found = [f"{name}: {count}" for name, count in counts if count]
+            if found:
+                text += "\nУже найдено: " + ", ".join(found)
+        return text
+
+    def perform_integrity_check(self, quick=False, on_results=None):
+        # quick - быстрая проверка по выборочным участкам вместо чтения файлов целиком.
+        # on_results(file_list, inventory, results) - вместо обычного отчёта передать результаты
+        # вызывающему (inventory и results - None, если проверка не состоялась, была отменена или упала).
+        import hashing
+        import integrity
         file_list = self.get_file_list()
-        total_files = len(file_list)
-        self.progress["maximum"] = total_files
+        if not file_list:
+            if on_results:
+                on_results(file_list, None, None)
+            return
+        samples = self.get_samples() if quick else None
+
+        # Хеши неизменённых с прошлой проверки файлов берутся из кэша
+        cache = integrity.VerifyCache(self.repair_dir / "verify_cache.json", Path.cwd(), file_list.algorithm).load()
+        # Журнал прерванной проверки: с него проверка продолжается после отмены или закрытия окна
+        journal = integrity.CheckJournal(self.repair_dir / "verify_journal.json", Path.cwd(),
+                                         integrity.journal_key(file_list)).load()
+        if self.force_rehash.get():
+            cache.clear()
+            journal.clear()
+        self.cancel_event = cancel = threading.Event()
+
+        # Прогресс считается в байтах по размерам из манифеста
+        tracker = integrity.ProgressTracker(sum(entry[2] for entry in file_list), len(file_list))
+        trace = None
+        if self.write_trace.get():
+            import tracing
+            trace = tracing.CheckTrace(Path.cwd())
+            reader = tracing.TracingReader(trace, on_read=tracker.on_read, cancel=cancel)
+        else:
+            reader = hashing.HashReader(on_read=tracker.on_read, cancel=cancel)
+
+        def task():
+            # Сначала один проход по папке с игрой: отсутствующие и лишние файлы видны без хеширования,
+            # а собранные stat переиспользуются при проверке.
+            # Файлы хешируются пулом потоков, а результаты возвращаются в порядке манифеста.
+            ignore = integrity.EXTRA_IGNORE
+            if getattr(sys, "frozen", False):
+                ignore += (Path(sys.executable).name,)  # сама утилита, скопированная в папку с игрой
+            inventory = integrity.take_inventory(Path.cwd(), file_list, ignore)
+            tracker.set_inventory(inventory)
+            results = integrity.check_files(file_list, on_progress=tracker.file_done, cache=cache, reader=reader,
+                                            journal=journal, cancel=cancel, quick=quick, samples=samples,
+                                            stats=inventory.stats)
+            return inventory, results
+
+        def on_finish(result):
+            inventory, results = result
+            if trace:
+                self.save_trace(trace)
+            if on_results:
+                on_results(file_list, inventory, results)
+                return
+            if inventory.extra:
+                self.report_extra_files(inventory.extra)
+            self.report_integrity(file_list, results, quick=quick)
+
+        def on_failed(error):
+            # Журнал ведёт только полная проверка, быстрая после отмены начинается заново
+            if isinstance(error, hashing.Cancelled) and not quick:
+                self.status_label.config(text="Проверка отменена. В следующий раз она продолжится с того же места.")
+            # Итоги остальных проверок (см. check_all) не должны теряться из-за отмены или ошибки
+            if on_results:
+                on_results(file_list, None, None)
+
+        self.run_in_background(task, tracker, on_finish, "Проверен файл", trace, cancellable=True, on_failed=on_failed)
+
+    def save_trace(self, trace):
+        trace_path = Path.cwd() / TRACE_FILE_NAME
+        try:
+            trace.write(trace_path)
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить журнал замеров:\n{e}")
+            return
+        outliers = trace.outliers()
+        message = f"Журнал замеров сохранён в файл:\n{trace_path}"
+        if outliers:
+            message += ("\n\nФайлы, которые читались или открывались заметно медленнее остальных:\n"
+                        + "\n".join(rel_path for rel_path, _ in outliers))
+        messagebox.showinfo("Журнал замеров", message)
+
+    def report_extra_files(self, extra):
+        # Лишние файлы ничего не ломают сами по себе, поэтому только сообщаем о них
+        shown = extra[:EXTRA_FILES_SHOWN]
+        if len(extra) > len(shown):
+            shown.append(f"... и ещё {len(extra) - len(shown)}")
+        messagebox.showinfo(
+            "Лишние файлы",
+            "В папке с игрой есть файлы, которых нет в её составе:\n"
+            + "\n".join(shown)
+            + "\n\nОбычно они не мешают, но если игра работает неправильно после установки\n"
+              "модификаций или патчей, стоит проверить эти файлы."
+        )
+
+    def report_integrity(self, file_list, results, then=None, quick=False):
+        import integrity
+        import repair
         failed_files = []
+        failed_entries = []
         total_size = 0
         failed_size = 0
+        not_sampled = 0
 
-        for idx, (file_path, expected_hash, expected_size) in enumerate(file_list, 1):
-            try:
-                rel_file_path = file_path.relative_to(Path.cwd())
-            except ValueError:
-                rel_file_path = file_path
-            self.status_label.config(text=f"Проверяется файл: {rel_file_path} ({idx}/{total_files})")
-            self.progress["value"] = idx
-            self.update_idletasks()
+        for (file_path, status, bad_ranges), entry in zip(results, file_list):
+            expected_size = entry[2]
+            total_size += expected_size
+            if status == integrity.NOT_SAMPLED:
+                not_sampled += 1
+            elif status != integrity.OK:
+                failed_entries.append((*entry, bad_ranges))
+                if bad_ranges:
+                    failed_files.append(f"{self.relative(file_path)} (повреждено: {integrity.format_ranges(bad_ranges)})")
+                else:
+                    failed_files.append(str(self.relative(file_path)))
+                failed_size += expected_size  # Add expected size of the failed or missing file
 
+        # messagebox.showinfo("Инфо", f'Общий размер: {total_size} \nБитый размер: {failed_size},\nРазница: {total_size - failed_size}')
 
-            total_size += expected_size
+        # Сначала предлагаем восстановить файлы из локального источника, а переустановку - только для оставшихся
+        source_root = self.ask_repair_source(failed_files) if failed_files else None
+        if not source_root:
+            self.finish_integrity_report(failed_files, failed_entries, [], then, quick, not_sampled)
+            return
 
-            if not file_path.exists():
-                failed_files.append(str(rel_file_path))
-                failed_size += expected_size  # Add expected size since the file is missing
-                continue
+        tracker = integrity.ProgressTracker(sum(entry[2] for entry in failed_entries), len(failed_entries))
 
-            actual_hash = self.compute_file_hash(file_path)
-            if actual_hash != expected_hash:
-                failed_files.append(str(rel_file_path))
-                failed_size += expected_size  # Add expected size of the failed file
+        def task():
+            return repair.repair_files(failed_entries, Path.cwd(), source_root, on_progress=tracker.file_done,
+                                       algorithm=self.hash_algorithm())
 
-        # messagebox.showinfo("Инфо", f'Общий размер: {total_size} \nБитый размер: {failed_size},\nРазница: {total_size - failed_size}')
+        def on_repaired(result):
+            repaired, not_repaired = result
+            if not_repaired:
+                messagebox.showwarning(
+                    "Восстановление файлов",
+                    (f"Восстановлено файлов: {len(repaired)}.\n" if repaired else "")
+                    + "Не удалось восстановить (в указанной папке их нет или они тоже повреждены):\n"
+                    + "\n".join(not_repaired)
+                )
+            self.finish_integrity_report(failed_files, failed_entries, repaired, then, quick, not_sampled)
+
+        self.run_in_background(task, tracker, on_repaired, "Восстановлен файл")
+
+    def finish_integrity_report(self, failed_files, failed_entries, repaired_files, then=None, quick=False,
+                                not_sampled=0):
+        # not_sampled - сколько файлов быстрая проверка не смогла сверить по содержимому
+        import webbrowser
+        failed_files = [name for name, entry in zip(failed_files, failed_entries)
+                        if str(self.relative(entry[0])) not in repaired_files]
 
         if failed_files:
             result = messagebox.askyesno(
@@ -206,160 +477,180 @@ class App(tk.Tk):
             if result:
                 webbrowser.open("https://yasuragivn.wordpress.com/sakura-no-uta/")  # Replace with actual link
 
+        elif repaired_files:
+            messagebox.showinfo("Проверка целостности", "Все повреждённые файлы восстановлены.")
+
+        elif quick and not_sampled:
+            messagebox.showinfo("Быстрая проверка", "Все файлы на месте и нужного размера.\n"
+                                                    f"Содержимое файлов ({not_sampled}) быстрая проверка сверить не может:\n"
+                                                    "для них в составе игры нет выборочных хешей.\n"
+                                                    "Чтобы проверить их содержимое, запустите полную проверку целостности.")
+
+        elif quick:
+            messagebox.showinfo("Быстрая проверка", "Быстрая проверка не нашла повреждённых файлов.\n"
+                                                    "Если проблемы остались, запустите полную проверку целостности.")
+
         else:
             messagebox.showinfo("Проверка целостности", "Все файлы успешно прошли проверку.")
 
-        self.status_label.config(text="")
-        self.progress["value"] = 0
+        if then:
+            then()
+
+    def ask_repair_source(self, failed_files):
+        # Предлагает восстановить повреждённые файлы из локальной копии игры или смонтированного образа.
+        # Возвращает выбранную папку или None.
+        from tkinter import filedialog
+        result = messagebox.askyesno(
+            "Проверка целостности",
+            "Следующие файлы не прошли проверку:\n"
+            + "\n".join(failed_files)
+            + "\n\nЕсли у вас есть папка с исправной копией игры или смонтированный\n"
+              "образ установщика, повреждённые файлы можно восстановить из них,\n"
+              "не переустанавливая игру. У больших архивов будут переписаны\n"
+              "только повреждённые участки.\n\n"
+              "Указать папку с исправными файлами?"
+        )
+        if not result:
+            return None
+        return filedialog.askdirectory(title="Папка с исправной копией игры") or None
 
     def get_file_list(self):
-        hash_file_path = resource_path("file_hashes.bin")
-        file_hash_list_abs = []
-        try:
-            with open(hash_file_path, "rb") as f:
-                file_hash_list = pickle.load(f)
-            current_dir = Path.cwd()
-            for rel_path_str, md5, file_size in file_hash_list:
-                rel_path = Path(rel_path_str)
-                file_path = current_dir / rel_path
-                file_hash_list_abs.append((file_path, md5, file_size))
-        except Exception as e:
-            messagebox.showerror("Ошибка", f"Не удалось загрузить список файлов для проверки:\n{e}")
-        return file_hash_list_abs
+        # Манифест встроен в утилиту и не меняется, поэтому разбирается один раз
+        import integrity
+        if self._file_list is None:
+            try:
+                self._file_list = integrity.load_file_list(resource_path("file_hashes.bin"), Path.cwd())
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось загрузить список файлов для проверки:\n{e}")
+                return []
+        return self._file_list
+
+    def get_samples(self):
+        import integrity
+        if self._samples is None:
+            try:
+                self._samples = integrity.load_samples(resource_path("file_hashes.bin")) or ()
+            except Exception:
+                self._samples = ()  # без выборок быстрая проверка сверяет первый и последний блоки
+        return self._samples or None
+
+    def get_manifest(self):
+        # Открытый встроенный манифест для поиска отдельных записей по пути, None - не загрузился
+        import manifest
+        if self._manifest is None:
+            try:
+                self._manifest = manifest.Manifest.load(resource_path("file_hashes.bin"))
+            except Exception:
+                return None
+        return self._manifest
 
-    def compute_file_hash(self, file_path):
-        md5_hash = hashlib.md5()
-        try:
-            with file_path.open("rb") as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    md5_hash.update(chunk)
-            return md5_hash.hexdigest()
-        except Exception as e:
-            return None
+    def hash_algorithm(self):
+        # Алгоритм хешей встроенного манифеста
+        import hashing
+        return getattr(self.get_file_list(), "algorithm", hashing.DEFAULT_ALGORITHM)
 
     def fix_font(self):
-        font_name = "YasuSakuuta.ttf"
-        if not self.is_font_installed(font_name):
-            result = messagebox.askyesno("Шрифт не найден", f"Необходимый шрифт '{font_name}' не найден.\nУстановить его?")
-            if result:
-                self.install_font(font_name)
+        import diagnostics
+        finding = diagnostics.check_font(self.probe)
+        if not finding.ok:
+            self.offer_font_install(finding)
         else:
-            messagebox.showinfo("Проверка шрифта", f"Шрифт '{font_name}' уже установлен.")
+            messagebox.showinfo("Проверка шрифта", f"Шрифт '{finding.data['font_name']}' уже установлен.")
 
-    def is_font_installed(self, font_name):
-        # Проверяем наличие шрифта в системной папке Fonts
-        fonts_dir = Path(os.environ['WINDIR']) / 'Fonts'
-        font_files = [font.name.lower() for font in fonts_dir.iterdir()]
-        return font_name.lower() in font_files
+    def offer_font_install(self, finding):
+        font_name = finding.data["font_name"]
+        result = messagebox.askyesno("Шрифт не найден", f"Необходимый шрифт '{font_name}' не найден.\nУстановить его?")
+        if result:
+            self.install_font(font_name)
+
+    def known_hash(self, file_path):
+        # (хеш, алгоритм, размер блока) файла из манифеста, хеш - None, если файла там нет
+        import hashing
+        file_manifest = self.get_manifest()
+        if file_manifest is None:
+            return None, hashing.DEFAULT_ALGORITHM, None
+        try:
+            idx = file_manifest.find(Path(file_path).relative_to(Path.cwd()).as_posix())
+        except ValueError:
+            idx = None
+        if idx is None:
+            return None, file_manifest.algorithm, None
+        _, expected_hash, _, _, block_hashes = file_manifest.entry(idx)
+        return expected_hash, file_manifest.algorithm, file_manifest.block_size if block_hashes else None
 
     def install_font(self, font_name):
-        fonts_dir = Path(os.environ['WINDIR']) / 'Fonts'
-        source_path = self.repair_dir / font_name
-        dest_path = fonts_dir / font_name
-
         try:
-            shutil.copyfile(source_path, dest_path)
-            # Регистрация шрифта в реестре
-            key = winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SOFTWARE\Microsoft\Windows NT\CurrentVersion\Fonts", 0, winreg.KEY_SET_VALUE | winreg.KEY_WRITE)
-            winreg.SetValueEx(key, font_name, 0, winreg.REG_SZ, font_name)
-            winreg.CloseKey(key)
-
-            # Обновляем кэш шрифтов
-            ctypes.windll.gdi32.AddFontResourceW(str(dest_path))
-            ctypes.windll.user32.SendMessageW(0xffff, 0x001D, 0, 0)
-
+            source_path = self.repair_dir / font_name
+            self.probe.install_font(source_path, *self.known_hash(source_path))
             messagebox.showinfo("Установка шрифта", f"Шрифт '{font_name}' успешно установлен.")
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось установить шрифт:\n{e}")
 
-    def get_locale_info(self):
-        lang_id = ctypes.windll.kernel32.GetSystemDefaultLangID()
-        primary_lang_id = lang_id & 0x3ff
-        locale_name = locale.windows_locale.get(lang_id, "Неизвестная")
-        codepage = ctypes.windll.kernel32.GetACP()
-        encoding = 'cp' + str(codepage)
-        return lang_id, primary_lang_id, locale_name, codepage, encoding
-
     def fix_window_title(self):
-        lang_id, primary_lang_id, locale_name, _, _ = self.get_locale_info()
-        LOCALE_RUSSIAN = [
-            0x19,  # Русский
-            0x22,  # Украинский
-            0x02,  # Болгарский
-            0x1a,  # Сербский (кириллица)
-            0x2f,  # Македонский
-            0x50,  # Монгольский (кириллица)
-            0x23,  # Белорусский
-            0x43,  # Узбекский (кириллица)
-            0x40  # Киргизский (кириллица)
-        ]
-
-        # LANG_RUSSIAN = 0x19
-        LOCALE_JAPANESE = 0x11
-
-        jp_ipl_md5_hash = "31888256646e301b74f8d7ce744eb0b8"
-        ru_ipl_md5_hash = "3190ae2bf6ff7ec09869cebb9bd102b8"
+        import diagnostics
+        import repair
+        finding = diagnostics.check_locale(self.probe, Path.cwd() / "ipl._bp")
+        # После замены утилитой сначала предлагаем вернуть прежний файл
+        if repair.has_backup(Path.cwd() / "ipl._bp", self.repair_dir / "backup") and self.offer_ipl_restore():
+            return
+        if finding.ok:
+            messagebox.showinfo("Проверка локали", f'Ваша системная локаль совместима с текущей\nконфигурацией!\nНикаких дополнительных действий не требуется.')
+        else:
+            self.offer_ipl_replacement(finding)
 
+    def offer_ipl_replacement(self, finding):
+        import repair
+        locale_name = finding.data["locale_name"]
         current_dir = Path.cwd()
-        curr_md5_hash = self.compute_file_hash(current_dir / "ipl._bp")
-
-        if primary_lang_id in LOCALE_RUSSIAN:
-            if curr_md5_hash == ru_ipl_md5_hash:
-                messagebox.showinfo("Проверка локали", f'Ваша системная локаль совместима с текущей\nконфигурацией!\nНикаких дополнительных действий не требуется.')
-            else:
-                result = messagebox.askyesno("Несоответствие локали", f'Ваша локаль: "{locale_name}" и текущий конфигурационный файл "{(current_dir / "ipl._bp").name}" не совместимы. Заменить этот файл на нужный?')
-                if result:
-                    source_file = self.repair_dir / "ipl_ru._bp"
-                    dest_file = current_dir / "ipl._bp"
-                    try:
-                        shutil.copyfile(source_file, dest_file)
-                        messagebox.showinfo("Починка локали", f'Файл "{source_file.name}" скопирован в "{current_dir} "как "{dest_file.name}".')
-                    except Exception as e:
-                        messagebox.showerror("Ошибка", f"Не удалось скопировать файл:\n{e}")
-
-        elif primary_lang_id == LOCALE_JAPANESE:
-            if curr_md5_hash == jp_ipl_md5_hash:
-                messagebox.showinfo("Проверка локали", f'Ваша системная локаль совместима с текущей\nконфигурацией!\nНикаких дополнительных действий не требуется.')
-            else:
-                result = messagebox.askyesno("Несоответствие локали", f'Ваша локаль: "{locale_name}" и текущий конфигурационный файл "{(current_dir / "ipl._bp").name}" не совместимы. Заменить этот файл на\nподходящий?')
-                if result:
-                    source_file = self.repair_dir / "ipl_jp._bp"
-                    dest_file = current_dir / "ipl._bp"
-                    try:
-                        shutil.copyfile(source_file, dest_file)
-                        messagebox.showinfo("Починка локали", f'Файл "{source_file.name}" скопирован в "{current_dir} "как "{dest_file.name}".')
-                    except Exception as e:
-                        messagebox.showerror("Ошибка", f"Не удалось скопировать файл:\n{e}")
-
+        if finding.data["supported"]:
+            result = messagebox.askyesno("Несоответствие локали", f'Ваша локаль: "{locale_name}" и текущий конфигурационный файл "{(current_dir / "ipl._bp").name}" не совместимы. Заменить этот файл на нужный?')
         else:
             result = messagebox.askyesno("Непподдерживаемая локаль",
                                          f'Ваша локаль: "{locale_name}" отсутствует в списке поддерживаемых напрямую, но вы можете воспользоваться универсальным файлом.\nПодставить универсальный файл?')
-            if result:
-                source_file = self.repair_dir / "ipl._bp"
-                dest_file = current_dir / "ipl._bp"
-                try:
-                    shutil.copyfile(source_file, dest_file)
-                    messagebox.showinfo("Починка локали",
-                                        f'Файл "{source_file.name}" скопирован в "{current_dir} "как "{dest_file.name}".')
-                except Exception as e:
-                    messagebox.showerror("Ошибка", f"Не удалось скопировать файл:\n{e}")
-
-
-    def is_path_valid(self, path):
-        _, _, _, codepage, encoding = self.get_locale_info()
-        invalid_components = []
-
-
-        path_obj = Path(path)
-        for part in path_obj.parts:
+        if result:
+            source_file = self.repair_dir / finding.data["replacement"]
+            dest_file = current_dir / "ipl._bp"
+            if finding.data["replacement_hash"]:
+                expected_hash, algorithm, block_size = finding.data["replacement_hash"], finding.data["replacement_algorithm"], None
+            else:
+                expected_hash, algorithm, block_size = self.known_hash(source_file)
+            backup_dir = self.repair_dir / "backup"
+            had_original = dest_file.exists()
             try:
-                part.encode(encoding)
-            except UnicodeEncodeError:
-                invalid_components.append(part)
-        return True if not invalid_components else invalid_components
-
+                # Файл движка заменяется атомарно и только проверенной копией, прежний сохраняется для отката
+                if repair.copy_verified(source_file, dest_file, expected_hash, backup_dir=backup_dir,
+                                        algorithm=algorithm, block_size=block_size):
+                    message = f'Файл "{source_file.name}" скопирован в "{current_dir} "как "{dest_file.name}".'
+                    if had_original:
+                        message += (f'\nПрежний файл сохранён в папке "{backup_dir}", вернуть его можно\n'
+                                    'повторным нажатием "Починить заголовок окна".')
+                    messagebox.showinfo("Починка локали", message)
+                else:
+                    messagebox.showerror("Ошибка", f'Файл "{source_file}" повреждён, "{dest_file.name}" не изменён.\n'
+                                                   "Проверьте целостность файлов.")
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось скопировать файл:\n{e}")
+
+    def offer_ipl_restore(self):
+        # Откат замены из offer_ipl_replacement: прежний файл лежит в repair/backup.
+        # False - пользователь отказался, и дальше идёт обычная проверка локали.
+        import repair
+        dest_file = Path.cwd() / "ipl._bp"
+        backup_dir = self.repair_dir / "backup"
+        result = messagebox.askyesno("Прежний файл движка",
+                                     f'Ранее утилита заменила файл "{dest_file.name}", прежний файл сохранён в папке "{backup_dir}".\n'
+                                     "Если после замены игра работает хуже, его можно вернуть. Вернуть прежний файл?")
+        if not result:
+            return False
+        try:
+            if repair.restore_backup(dest_file, backup_dir):
+                messagebox.showinfo("Прежний файл движка", f'Прежний файл "{dest_file.name}" возвращён.')
+        except OSError as e:
+            messagebox.showerror("Ошибка", f"Не удалось вернуть прежний файл:\n{e}")
+        return True
 
     def fix_path(self):
+        import diagnostics
 
         message = ("Если игра не запускается с ошибкой типа 'error!!', это\nозначает, что путь к игре содержит символы,\nнесовместимые с вашей системной локалью. Важно\nпонимать, что это распространяется на полный путь к\nигре, а не только на название её папки."
                     "\nИсправить эту ошибку можно несколькими способами:\n1. Убедиться, что в пути нет никаких других символов,\nкроме английских букв и цифр, например:\n'D:\\Games02\\Sakura no Uta'."
@@ -369,17 +660,15 @@ class App(tk.Tk):
 
         result = messagebox.askyesno("Проверка пути", message)
         if result:
-            current_dir = Path.cwd()
-            program_path = os.path.abspath(current_dir)
-            lang_id, _, _, codepage, encoding = self.get_locale_info()
-            locale_name = locale.windows_locale.get(lang_id, "Неизвестная")
+            program_path = os.path.abspath(Path.cwd())
+            finding = diagnostics.check_path(self.probe, program_path)
+            locale_name, encoding = finding.data["locale_name"], finding.data["encoding"]
 
-            invalid_components = self.is_path_valid(program_path)
-            if invalid_components is True:
+            if finding.ok:
                 messagebox.showinfo("Проблем не обнаружено",
                                     f"Путь содержит только допустимые символы для вашей\nлокали и кодировки ({locale_name}, {encoding}).")
             else:
-                invalid_components_str = '\n'.join(invalid_components)
+                invalid_components_str = '\n'.join(finding.data["invalid"])
                 path_message = (
                     f"Путь к игре: {program_path}\n"
                     f"Системная локаль: {locale_name}\n"
@@ -391,43 +680,67 @@ class App(tk.Tk):
                 messagebox.showwarning("Обнаружены недопустимые символы!", path_message)
 
     def check_all(self):
+        import diagnostics
         result = messagebox.askyesno("Подтверждение",
                                      "Вы уверены, что хотите выполнить все пункты?\nРекомендуется исправлять конкретные ошибки.")
-        if result:
-            threading.Thread(target=self._check_all_thread).start()
-
-    def _check_all_thread(self):
-        total_steps = 4
-        self.status_label.config(text="Проверяется целостность файлов")
-        self.perform_integrity_check()
-
-        # После проверки целостности файлов сбрасываем полосу прогресса
-        self.progress["maximum"] = total_steps
-        self.progress["value"] = 1
-        self.update_idletasks()
-
-        self.status_label.config(text="Проверяется шрифт")
-        self.fix_font()
-        self.progress["value"] = 2
-        self.update_idletasks()
-
-        self.status_label.config(text="Проверяется заголовок окна")
-        self.fix_window_title()
-        self.progress["value"] = 3
-        self.update_idletasks()
-
-        self.status_label.config(text="Проверяется путь")
-        self.fix_path()
-        self.progress["value"] = 4
-        self.update_idletasks()
-
-        self.status_label.config(text="Проверка завершена")
-        self.progress["value"] = 0
-        self.update_idletasks()
+        if not result:
+            return
 
+        # Быстрые проверки не ждут проверку целостности, а идут одновременно с ней
+        scheduler = diagnostics.Scheduler(diagnostics.system_checks(self.probe, Path.cwd())).start()
+        self.perform_integrity_check(
+            on_results=lambda file_list, inventory, results: self.report_all(scheduler, file_list, inventory, results))
+
+    def report_all(self, scheduler, file_list, inventory, results):
+        # Один общий отчёт по всем пунктам, затем исправление найденного по очереди
+        import integrity
+        findings = scheduler.results()
+        lines = []
+        failed = []
+        if results is None and self.cancel_event.is_set():
+            lines.append("Целостность файлов: проверка отменена")
+        elif results is None:
+            lines.append("Целостность файлов: проверить не удалось")
+        else:
+            failed = [result for result in results if result[1] not in (integrity.OK, integrity.NOT_SAMPLED)]
+            lines.append(f"Целостность файлов: повреждено или отсутствует файлов: {len(failed)}" if failed
+                         else "Целостность файлов: все файлы в порядке")
+            if inventory.extra:
+                lines.append(f"Лишние файлы в папке с игрой: {len(inventory.extra)}")
+        for name, title in (("font", "Шрифт"), ("locale", "Заголовок окна"), ("path", "Путь к игре")):
+            finding = findings[name]
+            if isinstance(finding, Exception):
+                lines.append(f"{title}: проверить не удалось ({finding})")
+            else:
+                lines.append(f"{title}: {finding.text}")
 
+        problems = [finding for finding in findings.values() if not isinstance(finding, Exception) and not finding.ok]
+        if failed or problems:
+            messagebox.showwarning("Проверка всего", "\n".join(lines) + "\n\nДалее будет предложено исправить найденное.")
+        else:
+            messagebox.showinfo("Проверка всего", "\n".join(lines) + "\n\nПроблем не обнаружено.")
+
+        def fix_rest():
+            for finding in problems:
+                if finding.name == "font":
+                    self.offer_font_install(finding)
+                elif finding.name == "locale":
+                    self.offer_ipl_replacement(finding)
+            # Путь утилита исправить не может, подробности есть в общем отчёте
+
+        if inventory is not None and inventory.extra:
+            self.report_extra_files(inventory.extra)
+        if failed:
+            self.report_integrity(file_list, results, then=fix_rest)
+        else:
+            fix_rest()
 
 
 if __name__ == "__main__":
     app = App()
+    if os.environ.get(EXIT_AFTER_START_ENV):
+        def on_map(event):
+            if event.widget is app:
+                app.after_idle(app.destroy)
+        app.bind("<Map>", on_map)
     app.mainloop()
@@ -0,0 +1,231 @@
+import io
+import mmap
+import struct
+import pickle
+import hashlib
+
+import hashing
+
+# Формат file_hashes.bin (все числа little-endian):
+#   заголовок   HEADER: сигнатура, версия, флаги, имя алгоритма хеша, размер хеша,
+#               размер блока (0 - поблочных хешей нет), число записей, число секций
+#   оглавление  число секций x SECTION: метка, смещение, длина
+#   секции      ENTR - записи фиксированного размера в порядке манифеста:
+#                      ENTRY + хеш файла (digest_size байт)
+#               PATH - пути в UTF-8 с разделителем '/', записи ссылаются на них по смещению
+#               HASH - открытая хеш-таблица: число слотов (степень двойки), затем слоты
+#                      с номером записи + 1 (0 - пустой слот)
+#               BLKS - хеши блоков подряд, записи ссылаются на них по номеру первого блока
+#               SMPL - необязательная: размер выборки, затем хеш выборочных участков
+#                      (hashing.sample_regions) для каждой записи в порядке манифеста
+# Старый формат (pickle со списком кортежей) по-прежнему читается.
+#
+# Версия 1 - только MD5. Версия 2 - алгоритм любой из hashing.ALGORITHMS; манифесты с MD5
+# по-прежнему пишутся версией 1, чтобы их читали и прежние сборки утилиты.
+
+MAGIC = b"SKMF"
+VERSION = 2
+
+HEADER = struct.Struct("<4sHH16sHHIII")
+SECTION = struct.Struct("<4sQQ")
+ENTRY = struct.Struct("<IHHQqII")
+SLOT = struct.Struct("<I")
+
+
+class ManifestError(Exception):
+    pass
+
+
+def path_hash(rel_path):
+    return int.from_bytes(hashlib.blake2b(rel_path.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def dump_manifest(records, algorithm="md5", block_size=0, samples=None, sample_size=0):
+    # records: [(относительный путь, хеш (bytes), размер, mtime_ns, [хеши блоков] или None), ...]
+    # samples: хеши выборок для быстрой проверки по одному на запись, None в списке - выборку
+    # посчитать не удалось (такой файл быстрая проверка проверит целиком)
+    digest_size = hashing.new_hash(algorithm).digest_size
+    if hashing.is_tree(algorithm) and not block_size:
+        raise ManifestError(f"Для алгоритма {algorithm} нужен размер блока")
+    entries = io.BytesIO()
+    paths = io.BytesIO()
+    blocks = io.BytesIO()
+    block_count_total = 0
+
+    slot_count = 1
+    while slot_count < len(records) * 2:
+        slot_count *= 2
+    slots = [0] * slot_count
+
+    for idx, (rel_path, digest, size, mtime_ns, block_hashes) in enumerate(records):
+        rel_path = rel_path.replace("\\", "/")
+        encoded = rel_path.encode("utf-8")
+        block_hashes = block_hashes or []
+        entries.write(ENTRY.pack(paths.tell(), len(encoded), 0, size, mtime_ns,
+                                 block_count_total, len(block_hashes)))
+        entries.write(digest)
+        paths.write(encoded)
+        for block_digest in block_hashes:
+            blocks.write(block_digest)
+        block_count_total += len(block_hashes)
+
+        slot = path_hash(rel_path) & (slot_count - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = idx + 1
+
+    sections = [
+        (b"ENTR", entries.getvalue()),
+        (b"PATH", paths.getvalue()),
+        (b"HASH", SLOT.pack(slot_count) + struct.pack(f"<{slot_count}I", *slots)),
+        (b"BLKS", blocks.getvalue()),
+    ]
+    if samples is not None and sample_size:
+        sections.append((b"SMPL", SLOT.pack(sample_size)
+                         + b"".join(sample or bytes(digest_size) for sample in samples)))
+
+    out = io.BytesIO()
+    version = 1 if algorithm == "md5" else VERSION
+    out.write(HEADER.pack(MAGIC, version, 0, algorithm.encode("ascii"), digest_size, 0,
+                          block_size, len(records), len(sections)))
+    offset = HEADER.size + SECTION.size * len(sections)
+    for tag, data in sections:
+        out.write(SECTION.pack(tag, offset, len(data)))
+        offset += len(data)
+    for _, data in sections:
+        out.write(data)
+    return out.getvalue()
+
+
+def write_manifest(path, records, algorithm="md5", block_size=0, samples=None, sample_size=0):
+    with open(path, "wb") as f:
+        f.write(dump_manifest(records, algorithm, block_size, samples, sample_size))
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+    # Старый манифест - это список кортежей из строк и чисел, никакие классы для него не нужны
+    def find_class(self, module, name):
+        raise ManifestError(f"Недопустимый объект в манифесте: {module}.{name}")
+
+
+def _records_from_pickle(data):
+    # Кортежи (путь, md5 hex, размер) или (путь, md5 hex, размер, размер блока, [md5 блоков hex])
+    records = []
+    block_size = 0
+    for rel_path, md5, size, *blocks in _RestrictedUnpickler(io.BytesIO(data)).load():
+        block_hashes = None
+        if blocks:
+            block_size, hex_blocks = blocks
+            block_hashes = [bytes.fromhex(block) for block in hex_blocks]
+        records.append((rel_path, bytes.fromhex(md5), size, 0, block_hashes))
+    return records, block_size
+
+
+class Manifest:
+    # Манифест, читаемый прямо из буфера (обычно mmap файла): записи разбираются
+    # только при обращении к ним, заранее ничего не распаковывается.
+
+    def __init__(self, buffer, mapping=None):
+        self.buffer = memoryview(buffer)
+        self.mapping = mapping
+        magic, version, _, algorithm, digest_size, _, block_size, count, section_count = \
+            HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ManifestError("Неизвестный формат манифеста")
+        if version > VERSION:
+            raise ManifestError(f"Неподдерживаемая версия манифеста: {version}")
+        self.version = version
+        self.algorithm = algorithm.rstrip(b"\0").decode("ascii")
+        if self.algorithm not in hashing.ALGORITHMS:
+            raise ManifestError(f"Неизвестный алгоритм хеширования в манифесте: {self.algorithm}")
+        self.digest_size = digest_size
+        self.block_size = block_size
+        self.count = count
+        self.record_size = ENTRY.size + digest_size
+
+        self.sections = {}
+        for idx in range(section_count):
+            tag, offset, length = SECTION.unpack_from(self.buffer, HEADER.size + idx * SECTION.size)
+            self.sections[tag] = (offset, length)
+        for tag in (b"ENTR", b"PATH", b"HASH", b"BLKS"):
+            if tag not in self.sections:
+                raise ManifestError(f"В манифесте нет секции {tag.decode()}")
+        self.slot_count = SLOT.unpack_from(self.buffer, self.sections[b"HASH"][0])[0]
+        self.sample_size = 0
+        if b"SMPL" in self.sections:
+            self.sample_size = SLOT.unpack_from(self.buffer, self.sections[b"SMPL"][0])[0]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                f.seek(0)
+                records, block_size = _records_from_pickle(f.read())
+                return cls(dump_manifest(records, "md5", block_size))
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapping, mapping)
+
+    def close(self):
+        self.buffer.release()
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def path(self, idx):
+        path_offset, path_len = ENTRY.unpack_from(self.buffer, self._record_offset(idx))[:2]
+        start = self.sections[b"PATH"][0] + path_offset
+        return str(self.buffer[start:start + path_len], "utf-8")
+
+    def entry(self, idx):
+        # (относительный путь, хеш, размер, mtime_ns, [хеши блоков] или None)
+        offset = self._record_offset(idx)
+        path_offset, path_len, _, size, mtime_ns, block_index, block_count = ENTRY.unpack_from(self.buffer, offset)
+        start = self.sections[b"PATH"][0] + path_offset
+        rel_path = str(self.buffer[start:start + path_len], "utf-8")
+        digest = bytes(self.buffer[offset + ENTRY.size:offset + self.record_size])
+        block_hashes = None
+        if block_count:
+            start = self.sections[b"BLKS"][0] + block_index * self.digest_size
+            block_hashes = [bytes(self.buffer[pos:pos + self.digest_size])
+                            for pos in range(start, start + block_count * self.digest_size, self.digest_size)]
+        return rel_path, digest, size, mtime_ns, block_hashes
+
+    def sample(self, idx):
+        # Хеш выборочных участков записи или None, если выборок в манифесте нет
+        if not self.sample_size:
+            return None
+        self._record_offset(idx)
+        start = self.sections[b"SMPL"][0] + SLOT.size + idx * self.digest_size
+        return bytes(self.buffer[start:start + self.digest_size])
+
+    def __iter__(self):
+        for idx in range(self.count):
+            yield self.entry(idx)
+
+    def find(self, rel_path):
+        # Номер записи по относительному пути или None
+        rel_path = rel_path.replace("\\", "/")
+        table = self.sections[b"HASH"][0] + SLOT.size
+        mask = self.slot_count - 1
+        slot = path_hash(rel_path) & mask
+        while True:
+            value = SLOT.unpack_from(self.buffer, table + slot * SLOT.size)[0]
+            if not value:
+                return None
+            if self.path(value - 1) == rel_path:
+                return value - 1
+            slot = (slot + 1) & mask
+
+    def _record_offset(self, idx):
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+        return self.sections[b"ENTR"][0] + idx * self.record_size
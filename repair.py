@@ -0,0 +1,143 @@
+import os
+import shutil
+from pathlib import Path
+
+import hashing
+import integrity
+
+
+def copy_verified(source_path, dest_path, expected_hash=None, reader=None, backup_dir=None,
+                  algorithm=hashing.DEFAULT_ALGORITHM, block_size=None):
+    # Копирует файл через временный файл рядом с назначением, попутно считая хеш: источник
+    # читается и назначение пишется ровно по одному разу. Назначение атомарно заменяется, только
+    # если хеш скопированных данных совпал с ожидаемым (без expected_hash - без сверки), так что
+    # прерванная или неудачная починка никогда не оставляет наполовину записанный файл.
+    # С backup_dir прежний файл сохраняется туда для отката (см. restore_backup). Если копия там
+    # уже есть, она не перезаписывается: при повторных заменах откат возвращает самый первый файл.
+    # algorithm и block_size - как в манифесте, из которого взят expected_hash.
+    dest_path = Path(dest_path)
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest_path.with_name(dest_path.name + ".tmp")
+    file_hash = hashing.Hasher(algorithm, block_size)
+    try:
+        with open(tmp_path, "wb") as dst:
+            for chunk in (reader or hashing.default_reader).chunks(source_path):
+                file_hash.update(chunk)
+                dst.write(chunk)
+            dst.flush()
+            os.fsync(dst.fileno())
+        if expected_hash is not None and file_hash.digest() != expected_hash:
+            return False
+        if backup_dir is not None and dest_path.exists():
+            _backup(dest_path, Path(backup_dir) / dest_path.name)
+        os.replace(tmp_path, dest_path)
+        return True
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def _backup(file_path, backup_path):
+    # Жёсткая ссылка ничего не копирует и после замены файла указывает на прежнее содержимое.
+    # Если ссылку сделать нельзя (другой том, FAT), файл копируется.
+    if backup_path.exists():
+        return
+    backup_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(file_path, backup_path)
+    except OSError:
+        shutil.copy2(file_path, backup_path)
+
+
+def has_backup(dest_path, backup_dir):
+    return (Path(backup_dir) / Path(dest_path).name).exists()
+
+
+def restore_backup(dest_path, backup_dir):
+    # Возвращает файл, сохранённый copy_verified в backup_dir (копия при этом забирается). False - копии нет.
+    dest_path = Path(dest_path)
+    backup_path = Path(backup_dir) / dest_path.name
+    if not backup_path.exists():
+        return False
+    os.replace(backup_path, dest_path)
+    return True
+
+
+def _read_block(f, offset, length):
+    f.seek(offset)
+    return f.read(length)
+
+
+def _digest(data, algorithm):
+    block_hash = hashing.new_hash(algorithm)
+    block_hash.update(data)
+    return block_hash.digest()
+
+
+def patch_blocks(source_path, dest_path, block_size, block_hashes, first_block=0, reader=None,
+                 algorithm=hashing.DEFAULT_ALGORITHM):
+    # Переписывает в dest_path только блоки, не совпавшие с манифестом, беря их из source_path.
+    # Каждый блок источника сверяется до записи, а записанный - перечитывается и сверяется снова.
+    # Возвращает количество переписанных блоков или None, если починить не удалось.
+    bad_ranges = integrity.check_blocks(dest_path, block_size, block_hashes[first_block:],
+                                        stop_at_first=False, offset=first_block * block_size, reader=reader,
+                                        algorithm=algorithm)
+    if not bad_ranges:
+        return 0
+
+    with open(source_path, "rb") as src, open(dest_path, "r+b") as dst:
+        for start, end in bad_ranges:
+            expected = block_hashes[start // block_size]
+            data = _read_block(src, start, end - start)
+            if _digest(data, algorithm) != expected:
+                return None  # источник повреждён в том же месте
+            dst.seek(start)
+            dst.write(data)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+        for start, end in bad_ranges:
+            if _digest(_read_block(dst, start, end - start), algorithm) != block_hashes[start // block_size]:
+                return None
+    return len(bad_ranges)
+
+
+def repair_files(failed_entries, install_root, source_root, on_progress=None, reader=None,
+                 algorithm=hashing.DEFAULT_ALGORITHM):
+    # failed_entries: [(file_path, expected_hash, expected_size, blocks, bad_ranges), ...] -
+    # записи манифеста, не прошедшие проверку, вместе с найденными повреждёнными участками.
+    # Файлы ищутся в source_root по тому же пути относительно install_root.
+    # on_progress(done, total, file_path, expected_size) вызывается после каждого файла.
+    # algorithm - алгоритм хешей манифеста (FileList.algorithm).
+    # Возвращает (починенные, непочиненные) списки относительных путей.
+    install_root = Path(install_root)
+    source_root = Path(source_root)
+    repaired = []
+    not_repaired = []
+    total = len(failed_entries)
+
+    for idx, (file_path, expected_hash, expected_size, blocks, bad_ranges) in enumerate(failed_entries, 1):
+        file_path = Path(file_path)
+        rel_path = file_path.relative_to(install_root)
+        source_path = source_root / rel_path
+        try:
+            if source_path.stat().st_size != expected_size:
+                raise OSError("размер файла в источнике не совпадает")
+
+            patched = None
+            block_size = blocks[0] if blocks else None
+            # Большой файл правильного размера чиним поблочно, остальное копируем целиком
+            if blocks and file_path.exists() and file_path.stat().st_size == expected_size:
+                first_block = bad_ranges[0][0] // block_size if bad_ranges else 0
+                patched = patch_blocks(source_path, file_path, *blocks, first_block=first_block, reader=reader,
+                                       algorithm=algorithm)
+            ok = patched is not None or copy_verified(source_path, file_path, expected_hash, reader,
+                                                      algorithm=algorithm, block_size=block_size)
+        except OSError:
+            ok = False
+
+        (repaired if ok else not_repaired).append(str(rel_path))
+        if on_progress:
+            on_progress(idx, total, file_path, expected_size)
+
+    return repaired, not_repaired
@@ -0,0 +1,123 @@
+import json
+import time
+import platform
+import threading
+from pathlib import Path
+
+import hashing
+
+# Необязательные замеры проверки целостности: для каждого файла - время открытия, чтения
+# и хеширования, объём и скорость, плюс общее время обновления интерфейса. Результат
+# пишется в компактный файл, который пользователь может приложить к сообщению об ошибке.
+# Без трассировки используется обычный HashReader, и замеры ничего не стоят.
+
+TRACE_VERSION = 1
+
+# Файл считается подозрительно медленным, если читался в OUTLIER_FACTOR раз медленнее медианы
+# (для файлов от MIN_OUTLIER_SIZE) или открывался дольше SLOW_OPEN секунд (антивирус и т.п.)
+OUTLIER_FACTOR = 4
+MIN_OUTLIER_SIZE = 1024 * 1024
+SLOW_OPEN = 0.1
+
+
+class CheckTrace:
+    def __init__(self, root):
+        self.root = Path(root)
+        self.started = time.time()
+        self.clock_started = time.perf_counter()
+        self.ui_time = 0.0
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def add(self, path, open_time=0.0, read_time=0.0, hash_time=0.0, size=0):
+        with self.lock:
+            stats = self.files.setdefault(Path(path), [0.0, 0.0, 0.0, 0])
+            stats[0] += open_time
+            stats[1] += read_time
+            stats[2] += hash_time
+            stats[3] += size
+
+    def add_ui_time(self, seconds):
+        self.ui_time += seconds
+
+    def rows(self):
+        # [(относительный путь, байт, открытие, чтение, хеширование, байт/с чтения), ...]
+        rows = []
+        with self.lock:
+            items = list(self.files.items())
+        for path, (open_time, read_time, hash_time, size) in items:
+            try:
+                rel_path = path.relative_to(self.root).as_posix()
+            except ValueError:
+                rel_path = str(path)
+            rate = size / read_time if read_time > 0 else 0.0
+            rows.append((rel_path, size, open_time, read_time, hash_time, rate))
+        return rows
+
+    def outliers(self, rows=None):
+        rows = self.rows() if rows is None else rows
+        rates = sorted(row[5] for row in rows if row[1] >= MIN_OUTLIER_SIZE and row[5] > 0)
+        median = rates[len(rates) // 2] if rates else 0.0
+        result = []
+        for rel_path, size, open_time, _, _, rate in rows:
+            if size >= MIN_OUTLIER_SIZE and 0 < rate < median / OUTLIER_FACTOR:
+                result.append((rel_path, "slow_read"))
+            elif open_time > SLOW_OPEN:
+                result.append((rel_path, "slow_open"))
+        return result
+
+    def write(self, path, **extra):
+        rows = self.rows()
+        data = {
+            "version": TRACE_VERSION,
+            "started": self.started,
+            "wall_seconds": round(time.perf_counter() - self.clock_started, 3),
+            "ui_seconds": round(self.ui_time, 3),
+            "platform": platform.platform(),
+            **extra,
+            "columns": ["path", "bytes", "open_ms", "read_ms", "hash_ms", "mb_per_s"],
+            "files": [[rel_path, size, round(open_time * 1000, 2), round(read_time * 1000, 2),
+                       round(hash_time * 1000, 2), round(rate / 1024 / 1024, 1)]
+                      for rel_path, size, open_time, read_time, hash_time, rate in rows],
+            "outliers": self.outliers(rows),
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+
+class TracingReader(hashing.HashReader):
+    # HashReader, который замеряет, сколько времени уходит на открытие файла, на само чтение
+    # (время внутри получения очередного куска) и на хеширование (время между кусками у потребителя)
+
+    def __init__(self, trace, **kwargs):
+        super().__init__(**kwargs)
+        self.trace = trace
+
+    def _open(self, path):
+        started = time.perf_counter()
+        fd = super()._open(path)
+        self._local.open_time = time.perf_counter() - started
+        return fd
+
+    def chunks(self, path, offset=0, length=None, block_size=None):
+        clock = time.perf_counter
+        chunks = super().chunks(path, offset, length, block_size)
+        self._local.open_time = 0.0
+        read_time = hash_time = 0.0
+        size = 0
+        try:
+            while True:
+                started = clock()
+                chunk = next(chunks, None)
+                resumed = clock()
+                read_time += resumed - started
+                if chunk is None:
+                    break
+                size += len(chunk)
+                yield chunk
+                hash_time += clock() - resumed
+        finally:
+            chunks.close()
+            open_time = self._local.open_time
+            # Открытие происходит внутри получения первого куска, из чтения его вычитаем
+            self.trace.add(path, open_time, max(0.0, read_time - open_time), hash_time, size)